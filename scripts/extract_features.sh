@@ -12,8 +12,9 @@ genome="$2"
 
 # Determine if the second argument is a file or a number
 if [ -f "$genome" ]; then
-    # Remove headers, count characters, subtract newline count
-    genome_size_bp=$(awk '{print $2 - $1}' < <(grep -v '^>' "$genome" | wc -l -c))
+    # Chunked FASTA scan, handles gzipped files and .fai indexes
+    script_dir="$(dirname "$0")"
+    genome_size_bp=$(python3 "$script_dir/genome_stats.py" --total "$genome") || exit 1
 elif [[ "$genome" =~ ^[0-9]+$ ]]; then
     genome_size_bp="$genome"
 else
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import utils.gff_tools as gff_tools
+import utils.length_stats as length_stats
+import utils.ncbi_plots as ncbi_plots
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Compare feature length distributions across annotations"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--annotations",
+        type=str,
+        required=True,
+        help="Folder with annotations",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--report",
+        type=str,
+        default=None,
+        help="annotations_report.tsv, used to group the plot by lca_rank",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=".",
+        help="Output folder (default: current dir)",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--features",
+        type=str,
+        default="gene,mRNA,exon,intron,CDS",
+        help="Comma separated feature types (default: gene,mRNA,exon,intron,CDS)",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=4,
+        help="Annotations processed in parallel (default: 4)",
+    )
+
+    args = parser.parse_args()
+
+    output_dir = os.path.join(args.output, "feature_lengths")
+    if os.path.exists(output_dir):
+        print("[ERROR] Output folder already exists")
+        sys.exit(1)
+
+    gff_list = gff_tools.list_gff(args.annotations)
+    if not gff_list:
+        print(f"[ERROR] No annotations found in {args.annotations}")
+        sys.exit(1)
+
+    os.makedirs(output_dir)
+    feature_types = args.features.split(",")
+
+    # one histogram per assembly and feature type, merged later if needed
+    rows = []
+    histograms = np.zeros(
+        (len(gff_list), len(feature_types), length_stats.N_BINS), dtype=np.int64
+    )
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = []
+        for gff in gff_list:
+            print(f"[INFO] Processing {gff}")
+            futures.append(
+                pool.submit(length_stats.compute_length_histograms, gff, feature_types)
+            )
+        for i, (gff, future) in enumerate(zip(gff_list, futures)):
+            stats = future.result()
+            rows += length_stats.summarise_lengths(gff_tools.get_gff_name(gff), stats)
+            for j, feature_type in enumerate(feature_types):
+                histograms[i, j] = stats[feature_type]["histogram"]
+
+    summary_df = pd.DataFrame(rows)
+    summary_path = os.path.join(output_dir, "feature_lengths.tsv")
+    summary_df.to_csv(summary_path, sep="\t", index=False)
+    np.savez_compressed(
+        os.path.join(output_dir, "feature_lengths_histograms.npz"),
+        histograms=histograms,
+        assemblies=np.array([gff_tools.get_gff_name(g) for g in gff_list]),
+        features=np.array(feature_types),
+        gamma=length_stats.GAMMA,
+    )
+
+    if args.report is not None and not summary_df.empty:
+        df = pd.read_csv(args.report, sep="\t")
+        df = df.rename(columns={col: col.replace(" ", "_") for col in df.columns})
+        ncbi_plots.plot_feature_lengths(summary_df, df, output_dir)
+
+    print(f"[INFO] Feature lengths saved at {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+import tabulate
+import utils.gene_index as gene_index
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Index gene names and identifiers of annotations and look them up"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--annotations",
+        type=str,
+        default=None,
+        help="Folder with annotations to index (only new or changed ones are parsed)",
+    )
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=gene_index.INDEX_FILE,
+        help=f"Index file (default: {gene_index.INDEX_FILE})",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Names or identifiers to look up (e.g. BRCA1 GeneID:672)",
+    )
+
+    parser.add_argument(
+        "--prefix",
+        action="store_true",
+        help="Match all the keys starting with the query",
+    )
+
+    parser.add_argument(
+        "--attributes",
+        type=str,
+        default=None,
+        help=(
+            "Comma separated attributes to match (default: all of "
+            f"{','.join(gene_index.INDEXED_ATTRIBUTES)})"
+        ),
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Save the matches to this TSV instead of printing them",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=4,
+        help="Annotations parsed in parallel (default: 4)",
+    )
+
+    args = parser.parse_args()
+
+    if args.annotations is None and not args.query:
+        print("[ERROR] Please specify annotations to index and/or a query")
+        sys.exit(1)
+
+    if args.annotations is not None:
+        gene_index.update_index(args.annotations, args.database, args.processes)
+        print(f"[INFO] Index saved at {args.database}")
+
+    if not args.query:
+        return
+
+    if not os.path.isfile(args.database):
+        print(f"[ERROR] Index not found: {args.database}")
+        sys.exit(1)
+
+    attributes = args.attributes.split(",") if args.attributes else None
+    con = gene_index.connect(args.database)
+    matches = pd.concat(
+        [
+            gene_index.lookup(con, term, args.prefix, attributes).assign(query=term)
+            for term in args.query
+        ],
+        ignore_index=True,
+    )
+    con.close()
+
+    if args.output is not None:
+        matches.to_csv(args.output, sep="\t", index=False)
+        print(f"[INFO] {len(matches)} matches saved to: {args.output}")
+    else:
+        print()
+        print(tabulate.tabulate(matches, headers="keys", showindex=False))
+        print()
+        print(
+            f"[INFO] {len(matches)} matches in "
+            f"{matches['accession'].nunique()} annotation(s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
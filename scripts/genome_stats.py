@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+import utils.fasta_stats as fasta_stats
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Length, N content and GC% of (gzipped) FASTA files"
+    )
+
+    parser.add_argument(
+        "fasta",
+        type=str,
+        nargs="+",
+        help="FASTA file(s), plain or gzipped",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Output TSV with per sequence stats (default: stdout)",
+    )
+
+    parser.add_argument(
+        "--total",
+        action="store_true",
+        help="Only print the total length of each file",
+    )
+
+    args = parser.parse_args()
+
+    rows = []
+    for fasta in args.fasta:
+        if not os.path.isfile(fasta):
+            print(f"[ERROR] File not found: {fasta}", file=sys.stderr)
+            sys.exit(1)
+
+        stats = fasta_stats.scan_fasta(fasta)
+        if args.total:
+            print(sum(s["Length"] for s in stats))
+            continue
+        for s in stats:
+            rows.append({"File": os.path.basename(fasta), **s})
+
+    if args.total:
+        return
+
+    df = pd.DataFrame(rows)
+    df.to_csv(args.output if args.output else sys.stdout, sep="\t", index=False)
+
+
+if __name__ == "__main__":
+    main()
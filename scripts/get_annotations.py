@@ -3,9 +3,17 @@
 import argparse
 import os
 import shutil
+import sys
 
+import pandas as pd
+import utils.integrity as integrity
 import utils.ncbi_plots as ncbi_plots
 import utils.ncbi_requests as ncbi_requests
+import utils.ncbi_select as ncbi_select
+import utils.ncbi_update as ncbi_update
+import utils.pipeline as pipeline
+import utils.pipeline_state as pipeline_state
+import utils.taxon_distance as taxon_distance
 
 
 def main():
@@ -43,22 +51,213 @@ def main():
         type=str,
         help="Taxonomic rank to retrieve (e.g. species, genus, family)",
     )
+    group.add_argument(
+        "-a",
+        "--auto",
+        action="store_true",
+        help="Pick the closest parent meeting --min-annotations and --max-gb",
+    )
+
+    parser.add_argument(
+        "--min-annotations",
+        type=int,
+        default=5,
+        help="Auto mode: minimum number of reference annotations (default: 5)",
+    )
+
+    parser.add_argument(
+        "--max-gb",
+        type=float,
+        default=None,
+        help="Auto mode: maximum download size in GB (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--max-level",
+        type=int,
+        default=8,
+        help="Auto mode: number of parent levels considered (default: 8)",
+    )
+
+    parser.add_argument(
+        "-u",
+        "--update",
+        action="store_true",
+        help="Update a previous run, downloading only new or superseded annotations",
+    )
+
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Download again a completed run whose outputs changed (deletes it)",
+    )
+
+    selection = parser.add_argument_group(
+        "selection", "Download only the assemblies passing these filters"
+    )
+    selection.add_argument(
+        "--max-assemblies",
+        type=int,
+        default=None,
+        help="Maximum number of assemblies, closest to the taxon first",
+    )
+    selection.add_argument(
+        "--max-lca-depth",
+        type=int,
+        default=None,
+        help="Maximum levels between the taxon and the last common ancestor",
+    )
+    selection.add_argument(
+        "--min-busco",
+        type=float,
+        default=None,
+        help="Minimum annotation BUSCO complete fraction (e.g. 0.9)",
+    )
+    selection.add_argument(
+        "--provider",
+        type=str,
+        action="append",
+        default=None,
+        help="Annotation provider to keep, can be repeated (e.g. 'NCBI RefSeq')",
+    )
+    selection.add_argument(
+        "--released-after",
+        type=str,
+        default=None,
+        help="Keep annotations released on or after this date (YYYY-MM-DD)",
+    )
+    selection.add_argument(
+        "--per-rank",
+        type=int,
+        default=None,
+        help="Keep at most this many assemblies per --sample-rank taxon, best first",
+    )
+    selection.add_argument(
+        "--sample-rank",
+        type=str,
+        default="genus",
+        help="Rank used by --per-rank (default: genus)",
+    )
+    selection.add_argument(
+        "--diverse",
+        type=int,
+        default=None,
+        help="Keep the most taxonomically diverse subset of this size",
+    )
+    selection.add_argument(
+        "--budget-gb",
+        type=float,
+        default=None,
+        help="Maximum total size of the downloaded annotations in GB",
+    )
+
+    pipelined = parser.add_argument_group(
+        "pipelined", "Process each batch of assemblies while the next ones download"
+    )
+    pipelined.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Download in batches, extracting and computing ministats as they arrive",
+    )
+    pipelined.add_argument(
+        "--batch-size",
+        type=int,
+        default=10,
+        help="Assemblies per downloaded batch (default: 10)",
+    )
+    pipelined.add_argument(
+        "--downloads",
+        type=int,
+        default=2,
+        help="Batches downloaded at the same time (default: 2)",
+    )
+    pipelined.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Batches processed at the same time (default: 4)",
+    )
+
+    parser.add_argument(
+        "--include",
+        type=str,
+        default=",".join(ncbi_requests.DEFAULT_INCLUDE),
+        help=(
+            "Comma separated content to download for each assembly, from "
+            f"{', '.join(ncbi_requests.CONTENT_TYPES)} (default: gff3)"
+        ),
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Parallel downloads (more than one content) and threads used to verify files (default: 8)",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=ncbi_requests.BACKENDS,
+        default=ncbi_requests.BACKEND,
+        help="How NCBI is queried: datasets CLI, Datasets REST API or a snapshot (default: cli)",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        type=str,
+        default=None,
+        help="Snapshot made by snapshot.py to resolve every query offline (sets -b snapshot)",
+    )
 
     args = parser.parse_args()
 
-    if args.level is None and args.rank is None:
+    if args.pipelined and args.update:
+        print("[ERROR] --pipelined can not be used with --update")
+        sys.exit(1)
+
+    if args.level is None and args.rank is None and not args.auto:
         args.level = 3  # Default fallback
         print("[INFO] Neither --level nor --rank specified. Defaulting to --level 3")
 
     ### Main body ##################################################################
 
+    if args.snapshot is not None:
+        args.backend = "snapshot"
+    ncbi_requests.set_backend(args.backend, args.snapshot)
+    include = ncbi_requests.check_include(args.include.split(","))
+
     datasets_dict = ncbi_requests.get_dataset_json(args.taxid)
     input_species_dict = datasets_dict[args.taxid]
 
     print(f"[INFO] Fetched information for taxon {args.taxid}")
 
     # Focus id is the taxon id to download annotations
-    if args.rank is not None:
+    if args.auto:
+        # availability of every parent level is computed once, before any download
+        atlas = ncbi_requests.report_annotation_counts_by_parents(
+            input_species_dict, args.max_level
+        )
+        ncbi_requests.add_download_sizes(atlas, include, args.threads)
+        os.makedirs(args.output, exist_ok=True)
+        atlas_path = os.path.join(args.output, f"{args.taxid}_atlas.tsv")
+        pd.DataFrame(atlas).to_csv(atlas_path, sep="\t", index=False)
+        print(f"[INFO] Annotation availability saved to: {atlas_path}")
+
+        focus = ncbi_requests.select_focus_from_atlas(
+            atlas, args.min_annotations, args.max_gb, include
+        )
+        if focus is None:
+            print(
+                f"[ERROR] No parent within {args.max_level} levels meets the targets. "
+                f"Check {atlas_path} and change --min-annotations/--max-gb/--max-level"
+            )
+            sys.exit(1)
+        focus_id = str(focus["taxon_id"])
+        print(f"[INFO] Auto selected {focus['rank']} {focus['name']} ({focus_id})")
+    elif args.rank is not None:
         focus_id = str(ncbi_requests.get_focus_id_rank(input_species_dict, args.rank))
         print(f"[INFO] The requested {args.rank} taxon id is {focus_id}")
     else:
@@ -68,36 +267,285 @@ def main():
     # Make sure there are at least one annotation available for the focus id
     annotations_count = ncbi_requests.get_annotation_count(focus_id)
     print(f"[INFO] {annotations_count} annotations found. Downloading them!")
+    if include != ncbi_requests.DEFAULT_INCLUDE:
+        sizes = ncbi_requests.get_content_sizes(focus_id, include)
+        for content, size_mb in sizes.items():
+            print(f"[INFO] {content}: {size_mb:.1f} MB available")
+
+    # Select assemblies before download when any filter is given
+    accessions = None
+    filters = [
+        args.max_assemblies,
+        args.max_lca_depth,
+        args.min_busco,
+        args.provider,
+        args.released_after,
+        args.budget_gb,
+        args.per_rank,
+        args.diverse,
+    ]
+    selecting = any(f is not None for f in filters)
+    focus_with_children = None
+    if selecting or args.update or args.pipelined:
+        # lineages of all the taxa below the focus, used for distances and sampling
+        focus_with_children = ncbi_requests.get_dataset_json(focus_id, children=True)
+        candidates = ncbi_select.list_candidates(
+            focus_id, args.taxid, focus_with_children
+        )
+        if candidates.empty:
+            print(f"[ERROR] No reference annotated assemblies listed for {focus_id}")
+            sys.exit(1)
 
-    # Download from NCBI
-    zip_path = ncbi_requests.download_annotation(
-        focus_id,
-        annotations_dir=args.output,
-        zip_name=f"{args.taxid}_to_{focus_id}_ncbi_dataset.zip",
+    if selecting:
+        candidates = ncbi_select.filter_candidates(
+            candidates,
+            max_count=args.max_assemblies,
+            max_lca_depth=args.max_lca_depth,
+            min_busco=args.min_busco,
+            providers=args.provider,
+            released_after=args.released_after,
+            max_gb=args.budget_gb,
+            dataset_dict=focus_with_children,
+            sample_rank=args.sample_rank,
+            per_rank=args.per_rank,
+            diverse=args.diverse,
+            include=include,
+        )
+        os.makedirs(args.output, exist_ok=True)
+        candidates_path = os.path.join(
+            args.output, f"{args.taxid}_to_{focus_id}_candidates.tsv"
+        )
+        candidates.to_csv(candidates_path, sep="\t", index=False)
+
+        accessions = candidates.loc[candidates["selected"], "Assembly_Accession"].tolist()
+        print(
+            f"[INFO] {len(accessions)} of {len(candidates)} assemblies selected, "
+            f"see {candidates_path}"
+        )
+        if not accessions:
+            print("[ERROR] No assemblies left after filtering, relax the filters")
+            sys.exit(1)
+    elif args.update or args.pipelined:
+        candidates["selected"] = True
+        accessions = candidates["Assembly_Accession"].tolist() if args.pipelined else None
+
+    download_location = os.path.join(
+        args.output, f"{args.taxid}_to_{focus_id}_ncbi_dataset"
     )
+    report_path = os.path.join(download_location, "annotations_report.tsv")
+    distance_path = os.path.join(download_location, "taxon_distance.npz")
+
+    # completed stages are recorded so an interrupted run can resume
+    manifest_path = f"{download_location}_manifest.json"
+    manifest = pipeline_state.load_manifest(manifest_path)
+    arguments = {
+        "focus_id": focus_id,
+        "include": include,
+        "max_assemblies": args.max_assemblies,
+        "max_lca_depth": args.max_lca_depth,
+        "min_busco": args.min_busco,
+        "provider": args.provider,
+        "released_after": args.released_after,
+        "budget_gb": args.budget_gb,
+        "per_rank": args.per_rank,
+        "sample_rank": args.sample_rank,
+        "diverse": args.diverse,
+        "pipelined": args.pipelined,
+        "batch_size": args.batch_size,
+    }
+
+    if args.update:
+        # only new or superseded annotations are fetched into the previous run,
+        # which then matches the current arguments
+        manifest["arguments"] = arguments
+        ann_df = ncbi_update.update_annotations(
+            download_location,
+            args.taxid,
+            focus_id,
+            candidates[candidates["selected"]],
+            threads=args.threads,
+            include=include,
+            manifest_path=manifest_path,
+            manifest=manifest,
+        )
+        taxon_distance.build_distance_matrix(
+            ann_df, distance_path, focus_with_children
+        )
+        pipeline_state.complete_stage(
+            manifest_path, manifest, "report", [report_path, distance_path]
+        )
+        stages = ["plots", "cleanup"]
+    else:
+        # a previous run is resumed only with the same downloaded content
+        pipeline_state.check_arguments(manifest_path, manifest, arguments)
+        resume_stage = pipeline_state.get_resume_stage(manifest)
 
-    # extract and reorg
-    download_location = ncbi_requests.extract_annotation_zip(zip_path)
-    ncbi_requests.flatten_and_rename_gff(download_location)
+        if resume_stage is None:
+            print(f"[INFO] All stages already completed, results in {download_location}")
+            return
+        # the downloaded dataset is gone once cleaned up, only plots can be redone
+        needs_dataset = pipeline_state.STAGES[: pipeline_state.STAGES.index("plots")]
+        cleaned = "cleanup" in manifest["stages"] and resume_stage in needs_dataset
+        if cleaned and not args.restart:
+            print(
+                f"[ERROR] Outputs of the completed run in {download_location} changed "
+                f"and can not be made again from {resume_stage}"
+            )
+            print("[ERROR] Use --update to refresh it or --restart to download it again")
+            sys.exit(1)
+        if cleaned:
+            resume_stage = pipeline_state.STAGES[0]
+
+        if resume_stage == pipeline_state.STAGES[0] and manifest["stages"]:
+            print("[WARNING] Outputs of the previous run changed, starting from scratch")
+            if os.path.exists(download_location):
+                shutil.rmtree(download_location)
+            manifest["stages"] = {}
+            manifest.pop("batches", None)
+            manifest.pop("running", None)
+        elif resume_stage != pipeline_state.STAGES[0] or "running" in manifest:
+            print(f"[INFO] Resuming previous run from stage {resume_stage}")
+
+        stages = pipeline_state.STAGES[pipeline_state.STAGES.index(resume_stage) :]
+
+    zip_path = f"{download_location}.zip"
+    annotations_dir = os.path.join(download_location, "annotations_ncbi")
+    verified_md5_path = os.path.join(download_location, integrity.VERIFIED_MD5)
+
+    if args.pipelined and "downloaded" in stages:
+        # download, extraction, flattening and ministats overlap batch by batch
+        pipeline_state.start_stage(manifest_path, manifest, "downloaded")
+        verified = pipeline.run_pipeline(
+            download_location,
+            focus_id,
+            accessions,
+            include=include,
+            batch_size=args.batch_size,
+            downloads=args.downloads,
+            workers=args.workers,
+            manifest_path=manifest_path,
+            manifest=manifest,
+        )
+        integrity.write_md5_file(verified_md5_path, verified)
+        manifest.pop("batches")  # recorded by the completed stage from now on
+        pipeline_state.complete_stage(
+            manifest_path,
+            manifest,
+            "flattened",
+            pipeline_state.list_files(annotations_dir),
+            checksums={os.path.join(download_location, p): c for p, c in verified.items()},
+        )
+        stages = stages[stages.index("report") :]
+
+    if "downloaded" in stages:
+        # Download from NCBI
+        pipeline_state.start_stage(manifest_path, manifest, "downloaded")
+        zip_path = ncbi_requests.download_annotation(
+            focus_id,
+            annotations_dir=args.output,
+            zip_name=os.path.basename(zip_path),
+            accessions=accessions,
+            include=include,
+        )
+        pipeline_state.complete_stage(manifest_path, manifest, "downloaded", [zip_path])
+
+    # extract, check against md5sum.txt (fetching again what fails) and reorg
+    if "extracted" in stages:
+        pipeline_state.start_stage(manifest_path, manifest, "extracted")
+        # also picks up an interrupted extraction or rehydration
+        ncbi_requests.extract_annotation_zip(
+            zip_path, download_location, threads=args.threads
+        )
+        verified = integrity.verify_and_repair(
+            download_location, focus_id, threads=args.threads, include=include
+        )
+        integrity.write_md5_file(
+            verified_md5_path, integrity.get_flattened_checksums(verified, include)
+        )
+        pipeline_state.complete_stage(
+            manifest_path,
+            manifest,
+            "extracted",
+            pipeline_state.list_files(download_location),
+            checksums={os.path.join(download_location, p): c for p, c in verified.items()},
+        )
+
+    # verified hashes are reused instead of reading the annotations again
+    verified_checksums = {}
+    if os.path.isfile(verified_md5_path):
+        verified_checksums = {
+            os.path.join(download_location, p): c
+            for p, c in integrity.read_md5_file(verified_md5_path).items()
+        }
+
+    if "flattened" in stages:
+        pipeline_state.start_stage(manifest_path, manifest, "flattened")
+        ncbi_requests.flatten_and_rename_gff(download_location, include)
+        pipeline_state.complete_stage(
+            manifest_path,
+            manifest,
+            "flattened",
+            pipeline_state.list_files(annotations_dir),
+            checksums=verified_checksums,
+        )
 
     # build annotation report with lca info
-    ann_df = ncbi_requests.build_annotation_report(download_location, args.taxid, focus_id)
+    if "report" in stages:
+        pipeline_state.start_stage(manifest_path, manifest, "report")
+        ann_df = ncbi_requests.build_annotation_report(
+            download_location, args.taxid, focus_id
+        )
+        taxon_distance.build_distance_matrix(
+            ann_df, distance_path, focus_with_children
+        )
+        pipeline_state.complete_stage(
+            manifest_path, manifest, "report", [report_path, distance_path]
+        )
+    elif not args.update:
+        ann_df = pd.read_csv(report_path, sep="\t")
 
     # make plots
     plots_dir = os.path.join(download_location, "annotations_report_plots")
-    os.makedirs(plots_dir)
 
-    ncbi_plots.plot_BUSCO(ann_df, plots_dir)
-    ncbi_plots.plot_assembly_stats(ann_df, plots_dir)
-    ncbi_plots.plot_gene_stats(ann_df, plots_dir)
-    ncbi_plots.plot_assembly_gaps(ann_df, plots_dir)
+    if "plots" in stages:
+        pipeline_state.start_stage(manifest_path, manifest, "plots")
+        os.makedirs(plots_dir, exist_ok=True)
+
+        ncbi_plots.plot_BUSCO(ann_df, plots_dir)
+        ncbi_plots.plot_assembly_stats(ann_df, plots_dir)
+        ncbi_plots.plot_gene_stats(ann_df, plots_dir)
+        ncbi_plots.plot_assembly_gaps(ann_df, plots_dir)
+
+        matrix = taxon_distance.load_distance_matrix(distance_path)
+        names = ann_df.set_index("Assembly_Accession")["Organism_Name"]
+        ncbi_plots.plot_taxon_distance(
+            matrix,
+            taxon_distance.get_taxonomic_order(matrix["lineages"]),
+            [f"{names.get(a, a)} ({a})" for a in matrix["accessions"]],
+            plots_dir,
+        )
 
-    print(f"[info] Plots saved at {plots_dir}")
+        print(f"[info] Plots saved at {plots_dir}")
+        pipeline_state.complete_stage(
+            manifest_path, manifest, "plots", pipeline_state.list_files(plots_dir)
+        )
 
     # clean up
-    shutil.rmtree(os.path.join(download_location, "ncbi_dataset"))
-    os.remove(os.path.join(download_location, "md5sum.txt"))
-    os.remove(os.path.join(download_location, "README.md"))
+    if "cleanup" in stages:
+        pipeline_state.start_stage(manifest_path, manifest, "cleanup")
+        # not there after a pipelined download or an interrupted cleanup
+        if os.path.isdir(os.path.join(download_location, "ncbi_dataset")):
+            shutil.rmtree(os.path.join(download_location, "ncbi_dataset"))
+        for name in ("md5sum.txt", "README.md"):
+            if os.path.isfile(os.path.join(download_location, name)):
+                os.remove(os.path.join(download_location, name))
+        pipeline_state.complete_stage(
+            manifest_path,
+            manifest,
+            "cleanup",
+            [report_path, distance_path] + pipeline_state.list_files(annotations_dir),
+            checksums=verified_checksums,
+        )
 
     print(f"[INFO] Done, results saved in {download_location}")
 
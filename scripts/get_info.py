@@ -15,14 +15,22 @@ def main():
         description="Download NCBI annotations of species related to a given taxon"
     )
 
-    parser.add_argument(
+    input_group = parser.add_mutually_exclusive_group(required=True)
+
+    input_group.add_argument(
         "-t",
         "--taxid",
         type=str,
-        required=True,
         help="NCBI taxonomy identifier (e.g., 9606 for Homo sapiens)",
     )
 
+    input_group.add_argument(
+        "-T",
+        "--taxid-file",
+        type=str,
+        help="File with one taxonomy identifier per line, shared ancestors are queried once",
+    )
+
     parser.add_argument(
         "-o",
         "--output",
@@ -39,16 +47,48 @@ def main():
         help="Enable extended mode: number of parent levels to include (e.g. 6)",
     )
 
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=ncbi_requests.BACKENDS,
+        default=ncbi_requests.BACKEND,
+        help="How NCBI is queried: datasets CLI, Datasets REST API or a snapshot (default: cli)",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        type=str,
+        default=None,
+        help="Snapshot made by snapshot.py to resolve every query offline (sets -b snapshot)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Concurrent queries in batch mode (default: 8)",
+    )
+
     args = parser.parse_args()
 
     ### main body
 
+    if args.snapshot is not None:
+        args.backend = "snapshot"
+    ncbi_requests.set_backend(args.backend, args.snapshot)
+
     # Ensure output directory exists
     if not os.path.exists(args.output):
         os.makedirs(args.output)
     else:
         print(f"[INFO] Output directory exists: {args.output}")
 
+    if args.taxid_file is not None:
+        run_batch(args)
+        return
+
     # Get input taxon dictionary
     datasets_dict = ncbi_requests.get_dataset_json(args.taxid)
     input_species_dict = datasets_dict[args.taxid]
@@ -80,5 +120,61 @@ def main():
     print(f"[INFO] Saved annotation report to: {output_path}")
 
 
+def read_taxid_file(taxid_file):
+
+    if not os.path.isfile(taxid_file):
+        print(f"[ERROR] Taxid file not found: {taxid_file}")
+        sys.exit(1)
+
+    with open(taxid_file) as in_f:
+        tax_ids = [
+            line.split()[0]
+            for line in in_f
+            if line.strip() and not line.startswith("#")
+        ]
+
+    # keep the input order, drop repeated taxa
+    return list(dict.fromkeys(tax_ids))
+
+
+def run_batch(args):
+    """
+    Reports all the taxa of a file: one TSV per taxon and a combined
+    long format table with the input taxid as first column.
+    """
+    tax_ids = read_taxid_file(args.taxid_file)
+    if not tax_ids:
+        print(f"[ERROR] No taxid found in {args.taxid_file}")
+        sys.exit(1)
+
+    datasets_dicts = ncbi_requests.get_dataset_json_batch(tax_ids)
+    missing = [t for t in tax_ids if t not in datasets_dicts]
+    for tax_id in missing:
+        print(f"[WARNING] Taxon {tax_id} not found, skipping")
+    datasets_dicts = {t: datasets_dicts[t] for t in tax_ids if t in datasets_dicts}
+
+    reports = ncbi_requests.report_annotation_counts_batch(
+        datasets_dicts, max_parents=args.extended, threads=args.threads
+    )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = "info" if args.extended is None else f"infoEXT{args.extended}"
+    batch_name = os.path.splitext(os.path.basename(args.taxid_file))[0]
+    combined_path = os.path.join(args.output, f"{batch_name}_{suffix}_{timestamp}.tsv")
+    if os.path.exists(combined_path):
+        print(f"[ERROR] Output file already exists: {combined_path}")
+        sys.exit(1)
+
+    combined = []
+    for tax_id, report in reports.items():
+        output_path = os.path.join(args.output, f"{tax_id}_{suffix}_{timestamp}.tsv")
+        pd.DataFrame(report).to_csv(output_path, sep="\t", index=False)
+        combined += [{"query_taxid": tax_id, **row} for row in report]
+
+    pd.DataFrame(combined).to_csv(combined_path, sep="\t", index=False)
+    print(f"[INFO] Saved {len(reports)} annotation reports to: {args.output}")
+    print(f"[INFO] Saved combined annotation report to: {combined_path}")
+
+
 if __name__ == "__main__":
     main()
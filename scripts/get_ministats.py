@@ -2,42 +2,10 @@
 
 import argparse
 import os
-import subprocess
 import sys
-import pandas as pd
-
-
-def get_assembly_metadata(metadata):
-
-    df = pd.read_csv(metadata, sep="\t")
-    assembly_dict = df.set_index("Assembly_Accession").to_dict(orient="index")
-
-    return assembly_dict
-
-
-def run_ministats(gff_file, genome_size, output_file):
-
-    # get location of the bash script to extract extract_features.sh
-    # assumes is in the same as this script
-    script_path = os.path.join(os.path.dirname(__file__), "extract_features.sh")
-    command = ["bash", str(script_path), str(gff_file), str(genome_size)]
-
-    try:
-        with open(output_file, "w") as out_f:
-            subprocess.run(
-                command, stdout=out_f, stderr=subprocess.PIPE, text=True, check=True
-            )
-
-        print(f"[INFO] Processing {gff_file}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] Error processing {gff_file}")
-        print(e.stderr)
 
-    except Exception as e:
-        print(f"[ERROR] Unexpected error processing {gff_file}: {e}")
-
-    return 0
+import pandas as pd
+import utils.ministats as ministats
 
 
 def main():
@@ -59,6 +27,13 @@ def main():
         type=str,
         help="Annotations metadata",
     )
+    parser.add_argument(
+        "-g",
+        "--genomes",
+        type=str,
+        default=None,
+        help="Folder with assemblies FASTA, their size replaces the metadata one",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -69,36 +44,30 @@ def main():
 
     args = parser.parse_args()
 
-    # add check to make sure all annotation have metadata
-
-    annotation_metadata = get_assembly_metadata(args.metadata)
-    annotation_list = [
-        a for a in os.listdir(args.annotations) if a.endswith((".gff", "gff3"))
-    ]
-
-    # Check if output directory exists
-    output_dir = os.path.join(args.output, "ministats")
-    if os.path.exists(output_dir):
-        print("[ERROR] Output folder already exists")
+    if args.metadata is None and args.genomes is None:
+        print("[ERROR] Please specify the annotations metadata and/or a genomes folder")
         sys.exit(1)
-    else:
-        os.makedirs(output_dir)
 
-    # Run ministats for each annotation
-    for a in annotation_list:
-        assembly_name, _ = os.path.splitext(a)
-        genome_size = annotation_metadata[assembly_name][
-            "Assembly_Stats_Total_Sequence_Length"
+    genome_sizes = pd.Series(dtype="Int64")
+    if args.metadata is not None:
+        genome_sizes = ministats.get_assembly_metadata(args.metadata)
+
+    # local assemblies are measured directly
+    if args.genomes is not None:
+        assembly_names = [
+            os.path.splitext(a)[0] for a in ministats.list_annotations(args.annotations)
         ]
-        if genome_size is None:
-            print(f"[WARNING] No metadata found for {a}, skipping.")
-            continue
+        fasta_sizes = ministats.get_genome_sizes_from_fasta(args.genomes, assembly_names)
+        genome_sizes = fasta_sizes.combine_first(genome_sizes)
 
-        annotation_path = os.path.join(args.annotations, a)
-        target = os.path.join(output_dir, f"ministats_{assembly_name}.tsv")
-        run_ministats(annotation_path, genome_size, target)
+    # Existing results are updated, only new or changed annotations are processed
+    output_dir = os.path.join(args.output, "ministats")
+    stats = ministats.update_ministats(args.annotations, genome_sizes, output_dir)
 
-    print(f"[INFO] Ministats saved at {output_dir}")
+    print(
+        f"[INFO] Ministats of {stats['Assembly_Accession'].nunique()} annotations "
+        f"saved at {os.path.join(output_dir, ministats.STATS_FILE)}"
+    )
 
 
 if __name__ == "__main__":
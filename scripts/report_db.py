@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+import tabulate
+import utils.report_db as report_db
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Collect annotation reports of many runs in one SQLite database"
+    )
+
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=os.path.join("annotations_ncbi", report_db.DB_FILE),
+        help=f"SQLite database (default: annotations_ncbi/{report_db.DB_FILE})",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Run folders or annotations_report.tsv files to ingest (ministats included when present)",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        default=None,
+        help="SQL query to run on the tables assemblies and ministats",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Save the query result to this TSV instead of printing it",
+    )
+
+    args = parser.parse_args()
+
+    if not args.input and args.query is None:
+        print("[ERROR] Please specify reports to ingest and/or a query")
+        sys.exit(1)
+
+    if not args.input and not os.path.isfile(args.database):
+        print(f"[ERROR] Database not found: {args.database}")
+        sys.exit(1)
+
+    database_dir = os.path.dirname(args.database)
+    if database_dir:
+        os.makedirs(database_dir, exist_ok=True)
+
+    con = report_db.connect(args.database)
+
+    for path in args.input:
+        report_db.ingest(con, path)
+
+    if args.query is not None:
+        df = report_db.query(con, args.query)
+        if args.output is not None:
+            df.to_csv(args.output, sep="\t", index=False)
+            print(f"[INFO] {len(df)} rows saved to: {args.output}")
+        else:
+            print()
+            print(tabulate.tabulate(df, headers="keys", showindex=False))
+            print()
+
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import os
 import sys
 import pandas as pd
 import utils.ncbi_plots as ncbi_plots
+import utils.report_db as report_db
 
 def main():
 
@@ -18,6 +19,19 @@ def main():
         type=str,
         help="annotation_report.tsv",
     )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        help="SQLite database made by report_db.py, used instead of the report",
+    )
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        default="SELECT * FROM assemblies",
+        help="SQL query selecting the assemblies to plot (default: all)",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -29,18 +43,28 @@ def main():
     args = parser.parse_args()
 
     # Check if output directory exists
-    if not args.report:
-        print ("[ERROR] Please specify a annotation_report.tsv")
+    if not args.report and not args.database:
+        print ("[ERROR] Please specify a annotation_report.tsv or a database")
         sys.exit(0)
 
-    output_dir = os.path.join(args.output, "annotation_report_plots")
-    if os.path.exists(output_dir):
-        print("[ERROR] Output folder already exists")
+    if args.database and not os.path.isfile(args.database):
+        print(f"[ERROR] Database not found: {args.database}")
         sys.exit(1)
+
+    if args.database:
+        con = report_db.connect(args.database)
+        df = report_db.query(con, args.query)
+        con.close()
+        if df.empty:
+            print("[ERROR] The query returned no assemblies")
+            sys.exit(1)
     else:
-        os.makedirs(output_dir)
+        df = pd.read_csv(args.report, sep="\t")
+
+    # plots whose input did not change since the last run are reused
+    output_dir = os.path.join(args.output, "annotation_report_plots")
+    os.makedirs(output_dir, exist_ok=True)
 
-    df = pd.read_csv(args.report, sep="\t")
     df = df.rename(columns={col: col.replace(" ", "_") for col in df.columns})
 
     ncbi_plots.plot_BUSCO(df, output_dir)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+import tabulate
+import utils.ncbi_requests as ncbi_requests
+import utils.ncbi_snapshot as ncbi_snapshot
+import utils.snapshot as snapshot
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Export the NCBI taxonomy, annotation counts, assembly metadata and "
+            "optionally the annotations of some clades into one snapshot file"
+        )
+    )
+
+    parser.add_argument(
+        "-c",
+        "--clades",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Taxonomy identifiers of the clades to export (e.g. 6656 7742)",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Snapshot file to write (e.g. phylocontext_snapshot.sqlite)",
+    )
+
+    parser.add_argument(
+        "--files",
+        type=str,
+        choices=["reference", "all"],
+        default=None,
+        help="Also store the files of the reference or of all the annotated assemblies",
+    )
+
+    parser.add_argument(
+        "--include",
+        type=str,
+        default=",".join(ncbi_requests.DEFAULT_INCLUDE),
+        help=(
+            "Comma separated content stored with --files, from "
+            f"{', '.join(ncbi_requests.CONTENT_TYPES)} (default: gff3)"
+        ),
+    )
+
+    parser.add_argument(
+        "-i",
+        "--info",
+        type=str,
+        default=None,
+        help="Print the content of an existing snapshot",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help="Concurrent queries and parallel downloads (default: 8)",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=["cli", "rest"],
+        default="cli",
+        help="How NCBI is queried during the export (default: cli)",
+    )
+
+    args = parser.parse_args()
+
+    if args.info is not None:
+        ncbi_snapshot.set_snapshot(args.info)
+        con = ncbi_snapshot.get_connection()
+        rows = list(ncbi_snapshot.get_meta().items())
+        for table in ["taxonomy", "genomes", "packages", "files"]:
+            rows.append((table, con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]))
+        print()
+        print(tabulate.tabulate(rows, headers=["key", "value"]))
+        print()
+        return
+
+    if not args.clades or args.output is None:
+        print("[ERROR] Please specify the clades to export and the output file")
+        sys.exit(1)
+
+    ncbi_requests.set_backend(args.backend)
+    include = ncbi_requests.check_include(args.include.split(","))
+
+    snapshot.export_snapshot(args.output, args.clades, args.files, include, args.threads)
+
+
+if __name__ == "__main__":
+    main()
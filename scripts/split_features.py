@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import utils.gff_tools as gff_tools
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Split annotations into one file per feature type"
+    )
+
+    parser.add_argument(
+        "-a",
+        "--annotations",
+        type=str,
+        required=True,
+        help="Folder with annotations",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=".",
+        help="Output folder (default: current dir)",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--features",
+        type=str,
+        default=None,
+        help="Comma separated feature types to keep (default: all, e.g. gene,CDS,ncRNA)",
+    )
+
+    parser.add_argument(
+        "-z",
+        "--compress",
+        action="store_true",
+        help="Write gzipped outputs",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=4,
+        help="Annotations processed in parallel (default: 4)",
+    )
+
+    args = parser.parse_args()
+
+    output_dir = os.path.join(args.output, "features_split")
+    if os.path.exists(output_dir):
+        print("[ERROR] Output folder already exists")
+        sys.exit(1)
+    os.makedirs(output_dir)
+
+    feature_types = None
+    if args.features is not None:
+        feature_types = set(args.features.split(","))
+
+    gff_list = gff_tools.list_gff(args.annotations)
+    if not gff_list:
+        print(f"[ERROR] No annotations found in {args.annotations}")
+        sys.exit(1)
+
+    # each annotation is read once, all types are written in the same pass
+    summary = {}
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = {}
+        for gff in gff_list:
+            print(f"[INFO] Processing {gff}")
+            futures[gff] = pool.submit(
+                gff_tools.split_gff, gff, output_dir, feature_types, args.compress
+            )
+        for gff, future in futures.items():
+            summary[gff_tools.get_gff_name(gff)] = future.result()
+
+    summary_df = pd.DataFrame(summary).fillna(0).astype(int).sort_index()
+    summary_df.index.name = "Feature"
+    summary_df.to_csv(os.path.join(output_dir, "features_split_counts.tsv"), sep="\t")
+
+    print(f"[INFO] Features saved at {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import gzip
+import mmap
+import os
+
+import numpy as np
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+FASTA_EXTENSIONS = (".fa", ".fna", ".fasta", ".fa.gz", ".fna.gz", ".fasta.gz")
+
+BASES = np.frombuffer(b"ACGTNacgtn", dtype=np.uint8)
+# every letter is a base (IUPAC codes included), anything else is layout
+LETTERS = np.array([chr(i).isalpha() for i in range(256)])
+LOWERCASE = np.array([chr(i).islower() for i in range(256)])
+
+
+def count_bytes(buffer, counts):
+    """
+    Adds the byte counts of buffer to counts, a 256 array.
+    """
+    counts += np.bincount(np.frombuffer(buffer, dtype=np.uint8), minlength=256)
+
+
+def summarise_counts(name, counts):
+
+    length = int(counts[LETTERS].sum())
+    a, c, g, t, n, a_low, c_low, g_low, t_low, n_low = counts[BASES]
+    acgt = a + c + g + t + a_low + c_low + g_low + t_low
+    gc = c + g + c_low + g_low
+
+    return {
+        "Sequence": name,
+        "Length": length,
+        "Ungapped_Length": length - int(n + n_low),
+        "N_Count": int(n + n_low),
+        "Lowercase_Count": int(counts[LOWERCASE].sum()),
+        "GC_Percent": round(100 * gc / acgt, 2) if acgt else 0.0,
+    }
+
+
+def read_fai(fai_path):
+    """
+    Sequences of a samtools .fai index: name, length, offset of the first
+    base, bases per line and bytes per line.
+    """
+    entries = []
+    with open(fai_path) as in_f:
+        for line in in_f:
+            name, length, offset, line_bases, line_width = line.split("\t")[:5]
+            entries.append(
+                (name, int(length), int(offset), int(line_bases), int(line_width))
+            )
+
+    return entries
+
+
+def scan_region(data, start, end):
+
+    counts = np.zeros(256, dtype=np.int64)
+    for chunk_start in range(start, end, CHUNK_SIZE):
+        count_bytes(data[chunk_start : min(end, chunk_start + CHUNK_SIZE)], counts)
+
+    return counts
+
+
+def scan_indexed_fasta(data, fai_path):
+    """
+    Uses the .fai offsets to count each sequence without looking for headers.
+    """
+    stats = []
+    for name, length, offset, line_bases, line_width in read_fai(fai_path):
+        if line_bases == 0:  # empty sequence, nothing to count
+            stats.append(summarise_counts(name, np.zeros(256, dtype=np.int64)))
+            continue
+        full_lines, remainder = divmod(length, line_bases)
+        end = offset + full_lines * line_width + remainder
+        stats.append(summarise_counts(name, scan_region(data, offset, end)))
+
+    return stats
+
+
+def scan_mapped_fasta(data):
+    """
+    Finds the headers of a memory mapped fasta and counts each sequence.
+    """
+    stats = []
+    header_start = data.find(b">")
+    while header_start != -1:
+        header_end = data.find(b"\n", header_start)
+        if header_end == -1:
+            header_end = len(data)
+        name = data[header_start + 1 : header_end].split()[0].decode()
+
+        next_header = data.find(b"\n>", header_end)
+        end = len(data) if next_header == -1 else next_header + 1
+        stats.append(summarise_counts(name, scan_region(data, header_end, end)))
+
+        header_start = -1 if next_header == -1 else next_header + 1
+
+    return stats
+
+
+def scan_stream(in_f):
+    """
+    Reads a (decompressed) fasta stream in fixed size chunks, headers
+    can be split between chunks. Each chunk is scanned from a moving offset,
+    only an unfinished header is carried over to the next one.
+    """
+    stats = []
+    name, counts = None, np.zeros(256, dtype=np.int64)
+    tail = b""
+    at_line_start = True
+
+    while True:
+        chunk = in_f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer = tail + chunk if tail else chunk
+        view = memoryview(buffer)
+        tail = b""
+        pos = 0
+
+        while True:
+            if at_line_start and buffer.startswith(b">", pos):
+                header_start = pos
+            else:
+                header_start = buffer.find(b"\n>", pos)
+                if header_start != -1:
+                    header_start += 1
+            if header_start == -1:
+                count_bytes(view[pos:], counts)
+                at_line_start = buffer.endswith(b"\n")
+                break
+            count_bytes(view[pos:header_start], counts)
+
+            header_end = buffer.find(b"\n", header_start)
+            if header_end == -1:
+                tail = buffer[header_start:]  # wait for the rest of the header
+                at_line_start = True
+                break
+
+            if name is not None:
+                stats.append(summarise_counts(name, counts))
+            name = buffer[header_start + 1 : header_end].split()[0].decode()
+            counts = np.zeros(256, dtype=np.int64)
+            pos = header_end + 1
+            at_line_start = True
+
+    if tail:  # last header, without sequence nor newline
+        if name is not None:
+            stats.append(summarise_counts(name, counts))
+        name, counts = tail[1:].split()[0].decode(), np.zeros(256, dtype=np.int64)
+    if name is not None:
+        stats.append(summarise_counts(name, counts))
+
+    return stats
+
+
+def scan_fasta(fasta_path):
+    """
+    Returns per sequence length, ungapped length, N count, lowercase count
+    and GC%. Gzipped files are streamed, plain files are memory mapped and
+    their .fai index is used when present.
+    """
+    if fasta_path.endswith(".gz"):
+        with gzip.open(fasta_path, "rb") as in_f:
+            return scan_stream(in_f)
+
+    if os.path.getsize(fasta_path) == 0:
+        return []
+
+    with open(fasta_path, "rb") as in_f:
+        with mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            fai_path = f"{fasta_path}.fai"
+            if os.path.isfile(fai_path):
+                return scan_indexed_fasta(data, fai_path)
+            return scan_mapped_fasta(data)
+
+
+def get_genome_size(fasta_path):
+
+    return sum(s["Length"] for s in scan_fasta(fasta_path))
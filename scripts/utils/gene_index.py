@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import pandas as pd
+import utils.gff_tools as gff_tools
+import utils.pipeline_state as pipeline_state
+
+INDEX_FILE = "gene_index.sqlite"
+
+# Attributes whose values are indexed, Dbxref values are split on ","
+INDEXED_ATTRIBUTES = ["ID", "Name", "gene", "gene_synonym", "locus_tag", "Dbxref"]
+# exons repeat the gene and Dbxref of their transcript
+SKIPPED_TYPES = {"exon"}
+
+COLUMNS = ["key", "attribute", "accession", "seqid", "start", "end", "type"]
+
+
+def connect(index_path):
+    """
+    Opens (creating it if needed) the index. Keys are also stored lower
+    case, the indexed column used by lookups.
+    """
+    con = sqlite3.connect(index_path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS features (lookup TEXT, key TEXT, attribute TEXT, "
+        "accession TEXT, seqid TEXT, start INTEGER, end INTEGER, type TEXT)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS idx_lookup ON features (lookup)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_accession ON features (accession)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS sources (accession TEXT PRIMARY KEY, fingerprint TEXT)"
+    )
+
+    return con
+
+
+def parse_keys(attributes):
+    """
+    Takes column 9 of a gff line and returns the (attribute, value) pairs
+    to index and the feature ID.
+    """
+    keys, feature_id = [], None
+    for field in attributes.strip().split(";"):
+        name, _, values = field.partition("=")
+        if name == "ID":
+            feature_id = values
+        if name not in INDEXED_ATTRIBUTES or not values:
+            continue
+        for value in values.split(","):
+            keys.append((name, unquote(value)))
+
+    return keys, feature_id
+
+
+def index_gff(gff_path):
+    """
+    Reads a gff once and returns one row per indexed key and feature.
+    Lines sharing an ID (e.g. CDS parts) are one feature spanning them all.
+    """
+    accession = gff_tools.get_gff_name(gff_path)
+    features = {}
+
+    with gff_tools.open_gff(gff_path) as in_f:
+        for n, line in enumerate(in_f):
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 9 or columns[2] in SKIPPED_TYPES:
+                continue
+
+            keys, feature_id = parse_keys(columns[8])
+            if not keys:
+                continue
+
+            seqid, feature_type = columns[0], columns[2]
+            start, end = int(columns[3]), int(columns[4])
+            feature = (seqid, feature_type, feature_id if feature_id else n)
+
+            if feature in features:
+                known_start, known_end, known_keys = features[feature]
+                features[feature] = (
+                    min(start, known_start),
+                    max(end, known_end),
+                    known_keys.union(keys),
+                )
+            else:
+                features[feature] = (start, end, set(keys))
+
+    return [
+        (value, attribute, accession, seqid, start, end, feature_type)
+        for (seqid, feature_type, _), (start, end, keys) in features.items()
+        for attribute, value in keys
+    ]
+
+
+def update_index(annotations_dir, index_path, processes=4):
+    """
+    Indexes the new or changed annotations of annotations_dir and drops the
+    ones no longer there. Parsing runs in parallel, rows are written by
+    this process only.
+    """
+    con = connect(index_path)
+    fingerprints = dict(con.execute("SELECT accession, fingerprint FROM sources"))
+
+    current = {
+        gff_tools.get_gff_name(gff): (gff, pipeline_state.get_fingerprint(gff))
+        for gff in gff_tools.list_gff(annotations_dir)
+    }
+    if not current:
+        print(f"[ERROR] No annotations found in {annotations_dir}")
+        sys.exit(1)
+
+    to_index = [a for a, (_, fp) in current.items() if fingerprints.get(a) != fp]
+    stale = [a for a in fingerprints if a not in current]
+    print(
+        f"[INFO] {len(to_index)} new or changed annotation(s), "
+        f"{len(current) - len(to_index)} up to date"
+    )
+
+    with con:
+        for accession in stale + to_index:
+            con.execute("DELETE FROM features WHERE accession = ?", (accession,))
+            con.execute("DELETE FROM sources WHERE accession = ?", (accession,))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {a: pool.submit(index_gff, current[a][0]) for a in to_index}
+        for accession, future in futures.items():
+            rows = future.result()
+            with con:
+                con.executemany(
+                    "INSERT INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(row[0].lower(),) + row for row in rows],
+                )
+                con.execute(
+                    "INSERT INTO sources VALUES (?, ?)",
+                    (accession, current[accession][1]),
+                )
+            print(f"[INFO] {len(rows)} keys indexed from {current[accession][0]}")
+
+    con.close()
+
+
+def lookup(con, term, prefix=False, attributes=None):
+    """
+    Features whose indexed keys equal (or start with, if prefix) term,
+    case insensitive. Prefix lookups are ranges on the sorted index.
+    """
+    term = term.lower()
+    if prefix:
+        query = "SELECT * FROM features WHERE lookup >= ? AND lookup < ?"
+        params = [term, term + "\U0010ffff"]
+    else:
+        query = "SELECT * FROM features WHERE lookup = ?"
+        params = [term]
+
+    if attributes:
+        query += f" AND attribute IN ({', '.join('?' * len(attributes))})"
+        params += list(attributes)
+
+    df = pd.read_sql_query(query, con, params=params)
+
+    return df[COLUMNS].drop_duplicates()
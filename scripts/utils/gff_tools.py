@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+
+
+def open_gff(gff_path, mode="rt"):
+    """
+    Opens plain or gzipped gff files.
+    """
+    if gff_path.endswith(".gz"):
+        return gzip.open(gff_path, mode)
+
+    return open(gff_path, mode)
+
+
+def list_gff(annotations_dir):
+
+    return sorted(
+        os.path.join(annotations_dir, a)
+        for a in os.listdir(annotations_dir)
+        if a.endswith((".gff", ".gff3", ".gff.gz", ".gff3.gz"))
+    )
+
+
+def get_gff_name(gff_path):
+    """
+    File name without .gff/.gff3(.gz), the assembly accession for ncbi annotations.
+    """
+    name = os.path.basename(gff_path)
+    for ext in (".gz", ".gff3", ".gff"):
+        if name.endswith(ext):
+            name = name[: -len(ext)]
+
+    return name
+
+
+def split_gff(gff_path, output_dir, feature_types=None, compress=False):
+    """
+    Reads a gff once and writes each feature type to its own file,
+    output_dir/<feature_type>/<name>.gff(.gz). Only feature_types are
+    kept when given. Returns the number of lines written per type.
+    """
+    name = get_gff_name(gff_path)
+    extension = ".gff.gz" if compress else ".gff"
+    outputs = {}
+    counts = {}
+
+    try:
+        with open_gff(gff_path) as in_f:
+            for line in in_f:
+                if line.startswith("#"):
+                    if line.startswith("##FASTA"):
+                        break
+                    continue
+
+                columns = line.split("\t", 3)
+                if len(columns) < 4:
+                    continue
+                feature_type = columns[2]
+                if feature_types is not None and feature_type not in feature_types:
+                    continue
+
+                out_f = outputs.get(feature_type)
+                if out_f is None:
+                    type_dir = os.path.join(output_dir, feature_type.replace("/", "_"))
+                    os.makedirs(type_dir, exist_ok=True)
+                    out_f = open_gff(os.path.join(type_dir, name + extension), "wt")
+                    out_f.write("##gff-version 3\n")
+                    outputs[feature_type] = out_f
+                    counts[feature_type] = 0
+
+                out_f.write(line)
+                counts[feature_type] += 1
+    finally:
+        for out_f in outputs.values():
+            out_f.close()
+
+    return counts
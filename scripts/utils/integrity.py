@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.ncbi_requests as ncbi_requests
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# md5 of the flattened annotations, written once the download is verified
+VERIFIED_MD5 = "annotations_md5.txt"
+
+
+def md5_file(path):
+
+    md5 = hashlib.md5()
+    with open(path, "rb") as in_f:
+        for chunk in iter(lambda: in_f.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def hash_files(paths, threads=8):
+    """
+    Returns {path: md5} of all paths. hashlib releases the GIL while hashing
+    large chunks, so files are read and hashed in parallel by a thread pool.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return dict(zip(paths, pool.map(md5_file, paths)))
+
+
+def read_md5_file(md5_path):
+    """
+    Reads an md5sum formatted file into {relative path: md5}.
+    """
+    checksums = {}
+    with open(md5_path) as in_f:
+        for line in in_f:
+            if not line.strip():
+                continue
+            md5, path = line.rstrip("\n").split(None, 1)
+            checksums[path.lstrip("*")] = md5
+
+    return checksums
+
+
+def read_fetch_file(base_folder):
+    """
+    Files of a dehydrated package, from its ncbi_dataset/fetch.txt (url,
+    size and path relative to ncbi_dataset), as {relative path: size}.
+    Sizes are None when not given. Empty if the package was not dehydrated.
+    """
+    fetch_path = os.path.join(base_folder, "ncbi_dataset", "fetch.txt")
+    if not os.path.isfile(fetch_path):
+        return {}
+
+    sizes = {}
+    with open(fetch_path) as in_f:
+        for line in in_f:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            size = int(fields[1]) if fields[1].isdigit() else None
+            sizes[f"ncbi_dataset/{fields[2]}"] = size
+
+    return sizes
+
+
+def write_md5_file(md5_path, checksums):
+
+    with open(md5_path, "w") as out_f:
+        for path, md5 in sorted(checksums.items()):
+            out_f.write(f"{md5}  {path}\n")
+
+
+def get_accession(path):
+    """
+    Accession of a dataset file, ncbi_dataset/data/<accession>/genomic.gff,
+    None for files shared by all the assemblies.
+    """
+    parts = path.split("/")
+    if len(parts) == 4 and parts[:2] == ["ncbi_dataset", "data"]:
+        return parts[2]
+
+    return None
+
+
+def verify_download(base_folder, paths=None, threads=8):
+    """
+    Checks the extracted files of base_folder against its md5sum.txt and,
+    for the files of a dehydrated package (not in md5sum.txt), against the
+    sizes of its fetch.txt, hashing them here. Only the given relative
+    paths are checked if any. Returns the verified {path: md5} and the
+    relative paths that are missing or corrupted.
+    """
+    expected = read_md5_file(os.path.join(base_folder, "md5sum.txt"))
+    fetched = {
+        p: size for p, size in read_fetch_file(base_folder).items() if p not in expected
+    }
+    if paths is not None:
+        expected = {p: expected[p] for p in paths if p in expected}
+        fetched = {p: fetched[p] for p in paths if p in fetched}
+
+    verified, failing = {}, []
+
+    present = [p for p in expected if os.path.isfile(os.path.join(base_folder, p))]
+    hashes = hash_files([os.path.join(base_folder, p) for p in present], threads)
+    for path, md5 in expected.items():
+        if hashes.get(os.path.join(base_folder, path)) == md5:
+            verified[path] = md5
+        else:
+            print(f"[WARNING] Missing or corrupted file: {path}")
+            failing.append(path)
+
+    complete = []
+    for path, size in fetched.items():
+        full_path = os.path.join(base_folder, path)
+        if os.path.isfile(full_path) and size in (None, os.path.getsize(full_path)):
+            complete.append(path)
+        else:
+            print(f"[WARNING] Missing or incomplete fetched file: {path}")
+            failing.append(path)
+    hashes = hash_files([os.path.join(base_folder, p) for p in complete], threads)
+    verified.update({p: hashes[os.path.join(base_folder, p)] for p in complete})
+
+    print(f"[INFO] {len(verified)} of {len(expected) + len(fetched)} files verified")
+
+    if paths is None:
+        unlisted = get_unlisted_files(base_folder, {**expected, **fetched})
+        if unlisted:
+            print(
+                f"[WARNING] {len(unlisted)} file(s) neither in md5sum.txt nor in "
+                f"fetch.txt can not be verified: {unlisted[:5]}"
+            )
+
+    return verified, failing
+
+
+def get_unlisted_files(base_folder, expected):
+    """
+    Relative paths of the extracted assembly files that the package does not list.
+    """
+    data_dir = os.path.join(base_folder, "ncbi_dataset", "data")
+    paths = [
+        os.path.relpath(os.path.join(root, name), base_folder).replace(os.sep, "/")
+        for root, _, names in os.walk(data_dir)
+        for name in names
+    ]
+
+    return sorted(p for p in paths if get_accession(p) is not None and p not in expected)
+
+
+def refetch_accessions(
+    base_folder,
+    focus_taxid,
+    accessions,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+    threads=8,
+):
+    """
+    Downloads again the given accessions and replaces their files in base_folder.
+    """
+    zip_path = ncbi_requests.download_annotation(
+        focus_taxid,
+        annotations_dir=os.path.dirname(base_folder),
+        zip_name=f"{os.path.basename(base_folder)}_refetch.zip",
+        accessions=accessions,
+        include=include,
+    )
+    refetch_location = ncbi_requests.extract_annotation_zip(zip_path, threads=threads)
+
+    listed = read_md5_file(os.path.join(refetch_location, "md5sum.txt"))
+    listed.update(read_fetch_file(refetch_location))
+    for path in listed:
+        if get_accession(path) in accessions and os.path.isfile(
+            os.path.join(refetch_location, path)
+        ):
+            dest_path = os.path.join(base_folder, path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            shutil.move(os.path.join(refetch_location, path), dest_path)
+
+    shutil.rmtree(refetch_location)
+
+
+def verify_and_repair(
+    base_folder,
+    focus_taxid,
+    threads=8,
+    max_attempts=2,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+):
+    """
+    Verifies an extracted download and fetches again only the accessions
+    with failing files. Exits if files can not be repaired.
+    Returns the verified {relative path: md5}.
+    """
+    verified, failing = verify_download(base_folder, threads=threads)
+
+    for attempt in range(max_attempts):
+        if not failing:
+            break
+
+        shared = [p for p in failing if get_accession(p) is None]
+        if shared:
+            print(f"[ERROR] Corrupted dataset files {shared}, download again", file=sys.stderr)
+            sys.exit(1)
+
+        accessions = sorted({get_accession(p) for p in failing})
+        print(f"[INFO] Fetching again {len(accessions)} accession(s): {accessions}")
+        refetch_accessions(base_folder, focus_taxid, accessions, include, threads)
+
+        newly_verified, failing = verify_download(base_folder, failing, threads)
+        verified.update(newly_verified)
+
+    if failing:
+        print(f"[ERROR] Files still failing verification: {failing}", file=sys.stderr)
+        sys.exit(1)
+
+    return verified
+
+
+def get_flattened_checksums(verified, include=ncbi_requests.DEFAULT_INCLUDE):
+    """
+    Maps the verified checksums of the genomic.gff (and other included)
+    files to their location after flatten_and_rename_gff.
+    """
+    suffixes = {
+        ncbi_requests.CONTENT_TYPES[c]["file"]: ncbi_requests.CONTENT_TYPES[c]["suffix"]
+        for c in include
+    }
+
+    return {
+        f"annotations_ncbi/{get_accession(path)}{suffixes[os.path.basename(path)]}": md5
+        for path, md5 in verified.items()
+        if get_accession(path) is not None and os.path.basename(path) in suffixes
+    }
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import csv
+import re
+
+import numpy as np
+import pandas as pd
+import utils.gff_tools as gff_tools
+
+# Lengths are counted in log spaced bins with 1% relative accuracy:
+# bin i holds lengths in (GAMMA**(i-1), GAMMA**i]. The histograms of several
+# assemblies can be summed and quantiles read from the cumulative counts.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+N_BINS = 1024  # up to ~1e9 bp
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+CHUNK_SIZE = 500_000
+
+
+def length_to_bin(lengths):
+
+    lengths = np.maximum(np.asarray(lengths, dtype=np.float64), 1)
+    bins = np.ceil(np.log(lengths) / np.log(GAMMA)).astype(np.int64)
+
+    return np.clip(bins, 0, N_BINS - 1)
+
+
+def bin_to_length(bins):
+    """
+    Representative length of each bin, within RELATIVE_ACCURACY of its content.
+    """
+    return 2 * GAMMA ** np.asarray(bins) / (GAMMA + 1)
+
+
+def get_intron_lengths(exons):
+    """
+    Takes exons (parent, start, end) and returns the gaps between consecutive
+    exons of the same parent.
+    """
+    exons = exons.sort_values(["parent", "start"])
+    same_parent = exons["parent"].values[1:] == exons["parent"].values[:-1]
+    gaps = exons["start"].values[1:] - exons["end"].values[:-1] - 1
+
+    return gaps[same_parent & (gaps > 0)]
+
+
+class FeatureLines:
+    """
+    Read-only view of an opened gff without its comment lines (starting
+    with "#") nor its ##FASTA section. A "#" inside the attributes is kept.
+    """
+
+    COMMENT = re.compile(r"^#.*\n?", re.MULTILINE)
+
+    def __init__(self, in_f, block_size=16 * 1024 * 1024):
+        self.in_f = in_f
+        self.block_size = block_size
+        self.tail = ""
+        self.done = False
+
+    def read(self, size=-1):
+        while not self.done:
+            block = self.in_f.read(self.block_size)
+            if not block:
+                self.done = True
+                text, self.tail = self.tail, ""
+            else:
+                # whole lines only, the last partial one waits for the next block
+                text = self.tail + block
+                cut = text.rfind("\n") + 1
+                text, self.tail = text[:cut], text[cut:]
+            fasta = text.find("##FASTA")
+            if fasta != -1 and (fasta == 0 or text[fasta - 1] == "\n"):
+                text, self.done = text[:fasta], True
+            text = self.COMMENT.sub("", text)
+            if text:
+                return text
+
+        return ""
+
+
+def read_gff_chunks(in_f):
+    """
+    Columns seqid, type, start, end and attributes of a gff, in chunks.
+    """
+    return pd.read_csv(
+        FeatureLines(in_f),
+        sep="\t",
+        header=None,
+        usecols=[0, 2, 3, 4, 8],
+        names=["seqid", "type", "start", "end", "attributes"],
+        dtype={
+            "seqid": str,
+            "type": "category",
+            "start": np.int64,
+            "end": np.int64,
+        },
+        quoting=csv.QUOTE_NONE,
+        chunksize=CHUNK_SIZE,
+    )
+
+
+def compute_length_histograms(gff_path, feature_types):
+    """
+    Streams a gff in chunks and returns, for each feature type, the histogram
+    of its lengths (N_BINS counts) plus count, sum, min and max. "intron" is
+    derived from exons sharing a Parent. In a sorted gff the exons of a
+    Parent are kept until the stream passes the end of the Parent feature
+    (or of its sequence), so memory does not grow with the file.
+    """
+    stats = {
+        t: {
+            "histogram": np.zeros(N_BINS, dtype=np.int64),
+            "count": 0,
+            "sum": 0,
+            "min": np.inf,
+            "max": 0,
+        }
+        for t in feature_types
+    }
+
+    def add_lengths(feature_type, lengths):
+        if len(lengths) == 0:
+            return
+        entry = stats[feature_type]
+        entry["histogram"] += np.bincount(length_to_bin(lengths), minlength=N_BINS)
+        entry["count"] += len(lengths)
+        entry["sum"] += int(lengths.sum())
+        entry["min"] = min(entry["min"], int(lengths.min()))
+        entry["max"] = max(entry["max"], int(lengths.max()))
+
+    # exons whose Parent may continue, and (seqid, end) of the features
+    # overlapping the stream position, possible Parents of the next exons
+    pending_exons = pd.DataFrame(
+        {
+            "seqid": pd.Series(dtype=str),
+            "start": pd.Series(dtype=np.int64),
+            "end": pd.Series(dtype=np.int64),
+            "parent": pd.Series(dtype=str),
+        }
+    )
+    spans = {}
+
+    with gff_tools.open_gff(gff_path) as in_f:
+        for chunk in read_gff_chunks(in_f):
+            lengths = (chunk["end"] - chunk["start"] + 1).values
+            types = chunk["type"].values
+            for feature_type in feature_types:
+                add_lengths(feature_type, lengths[types == feature_type])
+
+            if "intron" not in stats or chunk.empty:
+                continue
+
+            is_exon = types == "exon"
+            features = chunk[~is_exon]
+            ids = features["attributes"].str.extract(r"ID=([^;]+)", expand=False)
+            spans.update(
+                zip(ids[ids.notna()], zip(features["seqid"], features["end"]))
+            )
+
+            exons = chunk.loc[is_exon, ["seqid", "start", "end"]]
+            exons["parent"] = chunk.loc[is_exon, "attributes"].str.extract(
+                r"Parent=([^;]+)", expand=False
+            )
+            pending_exons = pd.concat(
+                [pending_exons, exons.dropna()], ignore_index=True
+            )
+
+            # a Parent is complete once the stream is past its end
+            seqid, position = chunk["seqid"].iloc[-1], chunk["start"].iloc[-1]
+            span_ends = pd.Series({i: e for i, (s, e) in spans.items() if s == seqid})
+            parent_ends = pending_exons["parent"].map(span_ends)
+            complete = (pending_exons["seqid"] != seqid) | (parent_ends < position)
+            add_lengths("intron", get_intron_lengths(pending_exons[complete]))
+            pending_exons = pending_exons[~complete]
+            spans = {
+                i: (s, e) for i, (s, e) in spans.items() if s == seqid and e >= position
+            }
+
+    if "intron" in stats:
+        add_lengths("intron", get_intron_lengths(pending_exons))
+
+    return stats
+
+
+def histogram_quantiles(histogram, quantiles=QUANTILES):
+
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return [np.nan] * len(quantiles)
+
+    ranks = np.round(np.asarray(quantiles) * (cumulative[-1] - 1))
+    bins = np.searchsorted(cumulative, ranks, side="right")
+
+    return list(bin_to_length(bins))
+
+
+def summarise_lengths(assembly_name, stats):
+    """
+    One summary row per feature type: count, mean, min, max and quantiles.
+    """
+    rows = []
+    for feature_type, entry in stats.items():
+        if entry["count"] == 0:
+            continue
+        row = {
+            "Assembly_Accession": assembly_name,
+            "Feature": feature_type,
+            "Count": entry["count"],
+            "Mean_Length": entry["sum"] / entry["count"],
+            "Min_Length": entry["min"],
+            "Max_Length": entry["max"],
+        }
+        for q, value in zip(QUANTILES, histogram_quantiles(entry["histogram"])):
+            # bin lengths may fall just outside the observed lengths
+            value = min(max(value, entry["min"]), entry["max"])
+            row[f"Q{int(q * 100):02d}_Length"] = round(value, 1)
+        rows.append(row)
+
+    return rows
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import utils.fasta_stats as fasta_stats
+import utils.pipeline_state as pipeline_state
+
+# Consolidated stats of all the annotations, one row per assembly and feature
+STATS_FILE = "ministats.parquet"
+# Fingerprint of the gff (and genome size) each assembly stats were computed from
+SOURCES_FILE = "ministats_sources.tsv"
+# Same stats as a feature x assembly matrix, one block of rows per value
+MATRIX_FILE = "ministats_matrix.parquet"
+MATRIX_VALUES = [
+    "Features_Count",
+    "Total_Feature_Length",
+    "Average_Feature_Length",
+    "Genome_Percentage",
+]
+
+STATS_DTYPES = {
+    "Feature": "category",
+    "Features_Count": "int64",
+    "Total_Feature_Length": "int64",
+    "Average_Feature_Length": "float32",
+    "Genome_Percentage": "float32",
+}
+
+
+# Only these columns are read from annotations_report.tsv
+METADATA_COLUMNS = {
+    "Assembly_Accession": "string",
+    "Assembly_Stats_Total_Sequence_Length": "Int64",
+}
+
+
+def get_assembly_metadata(metadata):
+    """
+    Returns the genome size of each assembly as a Series indexed by accession.
+    """
+    df = pd.read_csv(
+        metadata,
+        sep="\t",
+        usecols=list(METADATA_COLUMNS),
+        dtype=METADATA_COLUMNS,
+    )
+    genome_sizes = (
+        df.drop_duplicates(subset="Assembly_Accession")
+        .set_index("Assembly_Accession")["Assembly_Stats_Total_Sequence_Length"]
+        .dropna()
+    )
+
+    return genome_sizes
+
+
+def get_genome_sizes_from_fasta(genomes_dir, assembly_names):
+    """
+    Genome size of the assemblies with a local FASTA in genomes_dir, matched by
+    accession prefix (e.g. GCF_000001405.40_GRCh38.p14_genomic.fna.gz).
+    Returns a Series indexed by accession like get_assembly_metadata.
+    """
+    fasta_files = [
+        f for f in os.listdir(genomes_dir) if f.endswith(fasta_stats.FASTA_EXTENSIONS)
+    ]
+
+    genome_sizes = {}
+    for assembly_name in assembly_names:
+        prefixes = (f"{assembly_name}_", f"{assembly_name}.")
+        matches = [f for f in fasta_files if f.startswith(prefixes)]
+        if not matches:
+            continue
+        fasta_path = os.path.join(genomes_dir, sorted(matches)[0])
+        print(f"[INFO] Scanning {fasta_path}")
+        genome_sizes[assembly_name] = fasta_stats.get_genome_size(fasta_path)
+
+    return pd.Series(genome_sizes, dtype="Int64")
+
+
+def check_metadata(annotation_list, genome_sizes):
+    """
+    Makes sure every annotation has a genome size before any processing.
+    """
+    assembly_names = pd.Index([os.path.splitext(a)[0] for a in annotation_list])
+    missing = assembly_names[~assembly_names.isin(genome_sizes.index)]
+
+    if len(missing) > 0:
+        print(f"[ERROR] No genome size found for {len(missing)} annotation(s):")
+        for name in missing:
+            print(f"[ERROR]   {name}")
+        sys.exit(1)
+
+
+def run_ministats(gff_file, genome_size, output_file):
+
+    # get location of the bash script to extract extract_features.sh
+    # assumes is in the scripts folder, parent of utils
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script_path = os.path.join(scripts_dir, "extract_features.sh")
+    command = ["bash", str(script_path), str(gff_file), str(genome_size)]
+
+    try:
+        with open(output_file, "w") as out_f:
+            subprocess.run(
+                command, stdout=out_f, stderr=subprocess.PIPE, text=True, check=True
+            )
+
+        print(f"[INFO] Processing {gff_file}")
+
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] Error processing {gff_file}")
+        print(e.stderr)
+        return 1
+
+    except Exception as e:
+        print(f"[ERROR] Unexpected error processing {gff_file}: {e}")
+        return 1
+
+    return 0
+
+
+def list_annotations(annotations_dir):
+
+    return sorted(
+        a for a in os.listdir(annotations_dir) if a.endswith((".gff", "gff3"))
+    )
+
+
+def read_ministats(ministats_file, assembly_name):
+
+    df = pd.read_csv(ministats_file, sep="\t", dtype=STATS_DTYPES)
+    df.insert(0, "Assembly_Accession", assembly_name)
+
+    return df
+
+
+def load_ministats(output_dir):
+    """
+    Returns the consolidated stats table and the fingerprints of the
+    annotations it was computed from, both empty on a first run.
+    """
+    stats_path = os.path.join(output_dir, STATS_FILE)
+    sources_path = os.path.join(output_dir, SOURCES_FILE)
+
+    if not (os.path.isfile(stats_path) and os.path.isfile(sources_path)):
+        return pd.DataFrame(columns=["Assembly_Accession"] + list(STATS_DTYPES)), {}
+
+    stats = pd.read_parquet(stats_path)
+    sources = pd.read_csv(sources_path, sep="\t", dtype=str)
+    fingerprints = dict(zip(sources["Assembly_Accession"], sources["fingerprint"]))
+
+    return stats, fingerprints
+
+
+def update_ministats(annotations_dir, genome_sizes, output_dir):
+    """
+    Computes ministats only for the new or changed annotations of
+    annotations_dir and merges them in the consolidated table. Assemblies no
+    longer in the folder are dropped. Returns the updated table.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stats, fingerprints = load_ministats(output_dir)
+
+    annotation_list = list_annotations(annotations_dir)
+    check_metadata(annotation_list, genome_sizes)
+
+    current = {}
+    for a in annotation_list:
+        assembly_name, _ = os.path.splitext(a)
+        annotation_path = os.path.join(annotations_dir, a)
+        current[assembly_name] = (
+            annotation_path,
+            # recomputed when the gff or the genome size change
+            pipeline_state.get_fingerprint(
+                annotation_path, genome_sizes[assembly_name]
+            ),
+        )
+
+    to_run = [n for n, (_, fp) in current.items() if fingerprints.get(n) != fp]
+    print(
+        f"[INFO] {len(to_run)} new or changed annotation(s), "
+        f"{len(current) - len(to_run)} up to date"
+    )
+
+    new_tables = []
+    new_fingerprints = {}
+    for assembly_name in to_run:
+        annotation_path, fingerprint = current[assembly_name]
+        target = os.path.join(output_dir, f"ministats_{assembly_name}.tsv")
+        if run_ministats(annotation_path, genome_sizes[assembly_name], target) != 0:
+            continue  # not recorded, retried on next run
+        new_tables.append(read_ministats(target, assembly_name))
+        new_fingerprints[assembly_name] = fingerprint
+
+    # remove the stats of assemblies no longer available
+    for assembly_name in set(fingerprints) - set(current):
+        stale = os.path.join(output_dir, f"ministats_{assembly_name}.tsv")
+        if os.path.isfile(stale):
+            os.remove(stale)
+
+    unchanged = [n for n in current if n not in to_run and n in fingerprints]
+    stats = stats[stats["Assembly_Accession"].isin(unchanged)]
+    stats = pd.concat([stats] + new_tables, ignore_index=True)
+    stats = stats.astype(STATS_DTYPES)
+
+    fingerprints = {n: fingerprints[n] for n in unchanged}
+    fingerprints.update(new_fingerprints)
+
+    save_ministats(stats, fingerprints, output_dir)
+
+    return stats
+
+
+def save_ministats(stats, fingerprints, output_dir):
+
+    stats.to_parquet(os.path.join(output_dir, STATS_FILE), index=False)
+    get_ministats_matrix(stats).to_parquet(
+        os.path.join(output_dir, MATRIX_FILE), index=False
+    )
+    pd.DataFrame(
+        fingerprints.items(), columns=["Assembly_Accession", "fingerprint"]
+    ).to_csv(os.path.join(output_dir, SOURCES_FILE), sep="\t", index=False)
+
+
+def get_ministats_matrix(stats, values=MATRIX_VALUES):
+    """
+    Feature x assembly matrix of the ministats values: one column per
+    assembly, rows keyed by Value and Feature, so a single assembly can be
+    read without the others.
+    """
+    matrices = []
+    for value in values:
+        matrix = stats.pivot(
+            index="Feature", columns="Assembly_Accession", values=value
+        ).astype("float64")
+        matrix.columns = matrix.columns.astype(str)
+        matrix.insert(0, "Value", value)
+        matrices.append(matrix.reset_index())
+    matrix = pd.concat(matrices, ignore_index=True)
+    matrix["Feature"] = matrix["Feature"].astype(str)
+    matrix.columns.name = None
+
+    accessions = sorted(matrix.columns.drop(["Value", "Feature"]))
+
+    return matrix[["Value", "Feature"] + accessions]
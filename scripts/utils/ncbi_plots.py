@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
+import os
+import shutil
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
 
+# What was rendered in a plots folder: {title: {"hash", "file", "rendered"}}
+PLOT_MANIFEST = "plots_manifest.json"
+# Part of every plot hash, bump it when the look of the plots changes
+PLOT_VERSION = 1
 
-def build_filename(target, title):
+
+def build_filename(target, title, plot_hash=None):
+    """
+    Figures with a hash of their input are named after it, so the same
+    input always gives the same file. Others are timestamped.
+    """
+    if plot_hash is not None:
+        return f"{target}/{title}_{plot_hash[:12]}.png"
 
     timestamp = datetime.now().strftime("%y%m%d_%H%M")
     filename = f"{target}/{timestamp}_{title}.png"
@@ -14,6 +31,99 @@ def build_filename(target, title):
     return filename
 
 
+def get_plot_hash(title, data, params=None):
+    """
+    Hash of exactly what a figure shows: the plotted columns (DataFrames),
+    arrays or values in data and the plot parameters.
+    """
+    md5 = hashlib.md5(f"{PLOT_VERSION}:{title}".encode())
+
+    for item in data:
+        if isinstance(item, pd.DataFrame):
+            layout = [list(item.columns), [str(t) for t in item.dtypes]]
+            md5.update(json.dumps(layout).encode())
+            md5.update(pd.util.hash_pandas_object(item, index=False).values.tobytes())
+        elif isinstance(item, np.ndarray):
+            md5.update(f"{item.shape}:{item.dtype}".encode())
+            md5.update(np.ascontiguousarray(item).tobytes())
+        else:
+            md5.update(json.dumps(item, default=str).encode())
+
+    md5.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+
+    return md5.hexdigest()
+
+
+def load_plot_manifest(target):
+
+    manifest_path = os.path.join(target, PLOT_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path) as in_f:
+        return json.load(in_f)
+
+
+def link_plot(target, title, filename):
+    """
+    Points the stable name of a figure, <title>.png, to its current file.
+    """
+    link_path = os.path.join(target, f"{title}.png")
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+
+    try:
+        os.symlink(os.path.basename(filename), link_path)
+    except OSError:  # e.g. file systems without symlinks
+        shutil.copyfile(filename, link_path)
+
+
+def reuse_plot(target, title, plot_hash):
+    """
+    True if the figure was already rendered from the same input,
+    in which case rendering it again can be skipped.
+    """
+    entry = load_plot_manifest(target).get(title)
+    if entry is None or entry["hash"] != plot_hash:
+        return False
+
+    filename = os.path.join(target, entry["file"])
+    if not os.path.isfile(filename):
+        return False
+
+    link_plot(target, title, filename)
+    print(f"[INFO] {title} plot unchanged, reusing {filename}")
+
+    return True
+
+
+def save_plot(figure, target, title, plot_hash, dpi):
+    """
+    Saves a figure under its hash, links it to its stable name, records it
+    in the plots manifest and removes the figure it replaces.
+    """
+    filename = build_filename(target, title, plot_hash)
+    figure.savefig(filename, dpi=dpi, bbox_inches="tight")
+    link_plot(target, title, filename)
+
+    manifest = load_plot_manifest(target)
+    previous = manifest.get(title, {}).get("file")
+    if previous is not None and previous != os.path.basename(filename):
+        previous_path = os.path.join(target, previous)
+        if os.path.isfile(previous_path):
+            os.remove(previous_path)
+
+    manifest[title] = {
+        "hash": plot_hash,
+        "file": os.path.basename(filename),
+        "rendered": datetime.now().isoformat(timespec="seconds"),
+    }
+    manifest_path = os.path.join(target, PLOT_MANIFEST)
+    with open(f"{manifest_path}.tmp", "w") as out_f:
+        json.dump(manifest, out_f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
 def plot_BUSCO(df, target):
 
     species_col = "Organism_Name"
@@ -27,6 +137,12 @@ def plot_BUSCO(df, target):
         "lca_rank",
     ]
 
+    plot_hash = get_plot_hash(
+        "BUSCO", [df[[species_col] + cols + ["lca_starting_from"]]], {"dpi": 300}
+    )
+    if reuse_plot(target, "BUSCO", plot_hash):
+        return 0
+
     starting_taxon = str(df["lca_starting_from"].unique()[0])
 
     # Prepare the data: include all species, fill NaNs with 0
@@ -104,7 +220,7 @@ def plot_BUSCO(df, target):
     plt.tight_layout()
 
     # Saving
-    fig.savefig(build_filename(target, "BUSCO"), dpi=300, bbox_inches="tight")
+    save_plot(fig, target, "BUSCO", plot_hash, dpi=300)
     plt.close()
 
     return 0
@@ -126,6 +242,10 @@ def plot_annotations_info(df, target):
     ].copy()
     table_df.reset_index(drop=True, inplace=True)
 
+    plot_hash = get_plot_hash("summary_table", [table_df], {"dpi": 300})
+    if reuse_plot(target, "summary_table", plot_hash):
+        return 0
+
     # Create the figure — height scales with number of rows
     plt.figure()
     fig, ax = plt.subplots(
@@ -150,7 +270,7 @@ def plot_annotations_info(df, target):
     plt.tight_layout()
 
     # Saving
-    fig.savefig(build_filename(target, "summary_table"), dpi=300, bbox_inches="tight")
+    save_plot(fig, target, "summary_table", plot_hash, dpi=300)
     plt.close()
 
     return 0
@@ -172,6 +292,11 @@ def plot_assembly_stats(df, target):
 
     # Reshape to long format for seaborn
     plot_df = df[["Organism_Name", "lca_rank"] + variables].copy()
+
+    plot_hash = get_plot_hash("assembly_stats", [plot_df], {"dpi": 300})
+    if reuse_plot(target, "assembly_stats", plot_hash):
+        return 0
+
     plot_df = plot_df.melt(
         id_vars=["Organism_Name", "lca_rank"],
         value_vars=variables,
@@ -215,7 +340,7 @@ def plot_assembly_stats(df, target):
     plt.tight_layout()
 
     # Saving
-    g.savefig(build_filename(target, "assembly_stats"), dpi=300, bbox_inches="tight")
+    save_plot(g, target, "assembly_stats", plot_hash, dpi=300)
     plt.close()
 
     return 0
@@ -232,6 +357,11 @@ def plot_gene_stats(df, target):
 
     # Prepare data and melt into long format
     plot_df = df[["Organism_Name", "lca_rank"] + count_vars].copy()
+
+    plot_hash = get_plot_hash("gene_stats", [plot_df], {"dpi": 300})
+    if reuse_plot(target, "gene_stats", plot_hash):
+        return 0
+
     plot_df = plot_df.melt(
         id_vars=["Organism_Name", "lca_rank"],
         value_vars=count_vars,
@@ -276,7 +406,7 @@ def plot_gene_stats(df, target):
     plt.tight_layout()
 
     # Saving
-    g.savefig(build_filename(target, "gene_stats"), dpi=300, bbox_inches="tight")
+    save_plot(g, target, "gene_stats", plot_hash, dpi=300)
     plt.close()
     return 0
 
@@ -287,6 +417,12 @@ def plot_assembly_gaps(df, target):
     x_var = 'Assembly_Stats_Total_Sequence_Length'
     y_var = 'Assembly_Stats_Total_Ungapped_Length'
 
+    plot_hash = get_plot_hash(
+        "assembly_gaps", [df[["Organism_Name", "lca_rank", x_var, y_var]]], {"dpi": 150}
+    )
+    if reuse_plot(target, "assembly_gaps", plot_hash):
+        return 0
+
     fig, ax = plt.subplots(figsize=(8, 6))
 
     # Create scatterplot
@@ -341,7 +477,121 @@ def plot_assembly_gaps(df, target):
     plt.tight_layout()
 
     # Saving
-    plt.savefig(build_filename(target, "assembly_gaps"), dpi=150, bbox_inches="tight")
+    save_plot(fig, target, "assembly_gaps", plot_hash, dpi=150)
+    plt.close()
+
+    return 0
+
+
+def plot_feature_lengths(summary_df, df, target):
+    """
+    Length distribution of each feature type across annotations, from the
+    quantiles of length_stats: whiskers 5-95%, box 25-75% and median.
+    """
+    plot_df = summary_df.merge(
+        df[["Assembly_Accession", "Organism_Name", "lca_rank"]],
+        on="Assembly_Accession",
+        how="left",
+    )
+    plot_df["lca_rank"] = plot_df["lca_rank"].fillna("")
+    plot_df["Organism_label"] = (
+        plot_df["Organism_Name"].fillna(plot_df["Assembly_Accession"])
+        + " ("
+        + plot_df["Assembly_Accession"]
+        + ")"
+    )
+
+    plot_hash = get_plot_hash("feature_lengths", [plot_df], {"dpi": 300})
+    if reuse_plot(target, "feature_lengths", plot_hash):
+        return 0
+
+    features = sorted(plot_df["Feature"].unique())
+    ranks = sorted(plot_df["lca_rank"].unique())
+    palette = dict(zip(ranks, sns.color_palette(n_colors=len(ranks))))
+    labels = sorted(plot_df["Organism_label"].unique())
+
+    plt.figure()
+    fig, axes = plt.subplots(
+        1,
+        len(features),
+        figsize=(5 * len(features), max(3, len(labels) * 0.4)),
+        sharey=True,
+        squeeze=False,
+    )
+
+    for ax, feature in zip(axes[0], features):
+        feature_df = plot_df[plot_df["Feature"] == feature]
+        y = feature_df["Organism_label"].map({l: i for i, l in enumerate(labels)})
+        colors = feature_df["lca_rank"].map(palette)
+
+        ax.hlines(
+            y,
+            feature_df["Q05_Length"],
+            feature_df["Q95_Length"],
+            colors=colors,
+            linewidth=1,
+        )
+        ax.hlines(
+            y,
+            feature_df["Q25_Length"],
+            feature_df["Q75_Length"],
+            colors=colors,
+            linewidth=5,
+        )
+        ax.scatter(feature_df["Q50_Length"], y, color="black", s=10, zorder=3)
+
+        ax.set_xscale("log")
+        ax.set_title(feature)
+        ax.set_xlabel("Length (bp)")
+        ax.grid(True, axis="x", linestyle="--", alpha=0.3)
+
+    axes[0][0].set_yticks(range(len(labels)))
+    axes[0][0].set_yticklabels(labels, fontsize=8)
+    axes[0][0].invert_yaxis()
+
+    handles = [plt.Line2D([0], [0], color=palette[r], linewidth=5) for r in ranks]
+    fig.legend(handles, ranks, title="LCA Rank", loc="upper right", frameon=True)
+    fig.suptitle("Feature Length Distributions", fontsize=16, y=1.01)
+    plt.tight_layout()
+
+    # Saving
+    save_plot(fig, target, "feature_lengths", plot_hash, dpi=300)
+    plt.close()
+
+    return 0
+
+
+def plot_taxon_distance(matrix, order, labels, target):
+    """
+    Heatmap of the pairwise taxonomic distances, rows and columns in
+    taxonomic order so that closely related assemblies cluster together.
+    """
+    distance = matrix["distance"][order][:, order]
+    labels = [labels[i] for i in order]
+    show_labels = len(labels) <= 100
+
+    plot_hash = get_plot_hash("taxon_distance", [distance, labels], {"dpi": 150})
+    if reuse_plot(target, "taxon_distance", plot_hash):
+        return 0
+
+    size = min(max(6, len(labels) * 0.25), 30)
+    fig, ax = plt.subplots(figsize=(size + 2, size))
+
+    sns.heatmap(
+        distance,
+        cmap="viridis_r",
+        square=True,
+        xticklabels=labels if show_labels else False,
+        yticklabels=labels if show_labels else False,
+        cbar_kws={"label": "Taxonomic distance (levels through the LCA)"},
+        ax=ax,
+    )
+    ax.tick_params(labelsize=7)
+    ax.set_title("Pairwise Taxonomic Distance", fontsize=14)
+    plt.tight_layout()
+
+    # Saving
+    save_plot(fig, target, "taxon_distance", plot_hash, dpi=150)
     plt.close()
 
     return 0
@@ -5,11 +5,49 @@ import os
 import shutil
 import subprocess
 import sys
-import time
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 
 import pandas as pd
+import utils.ncbi_rest as ncbi_rest
+import utils.ncbi_snapshot as ncbi_snapshot
+
+# Backend used for datasets queries: "cli" runs the datasets binary,
+# "rest" calls the Datasets v2 API through a pooled keep-alive connection,
+# "snapshot" reads a file exported by snapshot.py, no network needed
+BACKENDS = ["cli", "rest", "snapshot"]
+BACKEND = os.environ.get("PHYLOCONTEXT_BACKEND", "cli")
+
+# Content of the genome packages, by datasets --include value: file name in
+# the package, suffix once flattened per accession and download preview key
+CONTENT_TYPES = {
+    "gff3": {"file": "genomic.gff", "suffix": ".gff", "preview": "genome_gff"},
+    "gtf": {"file": "genomic.gtf", "suffix": ".gtf", "preview": "genome_gtf"},
+    "protein": {"file": "protein.faa", "suffix": ".faa", "preview": "prot_fasta"},
+    "cds": {"file": "cds_from_genomic.fna", "suffix": ".cds.fna", "preview": "cds_fasta"},
+}
+DEFAULT_INCLUDE = ["gff3"]
+
+# Taxa with more assemblies than this are not listed to count their
+# annotations (e.g. a kingdom), they are counted with previews instead
+LISTING_MAX_ASSEMBLIES = 5000
+
+
+def set_backend(backend, snapshot_path=None):
+
+    global BACKEND
+    if backend not in BACKENDS:
+        print(f"[ERROR] Unknown backend {backend}, choose from {BACKENDS}")
+        sys.exit(1)
+    if backend == "snapshot":
+        snapshot_path = snapshot_path or ncbi_snapshot.SNAPSHOT_PATH
+        if snapshot_path is None:
+            print("[ERROR] No snapshot given, use --snapshot or PHYLOCONTEXT_SNAPSHOT")
+            sys.exit(1)
+        ncbi_snapshot.set_snapshot(snapshot_path)
+    BACKEND = backend
 
 
 def get_dataset_json(tax_id, children=False):
@@ -19,6 +57,19 @@ def get_dataset_json(tax_id, children=False):
     of children available for taxid.
     """
 
+    if BACKEND in ("rest", "snapshot"):
+        if BACKEND == "rest":
+            datasets_json = ncbi_rest.get_taxonomy_reports([tax_id], children=children)
+        else:
+            datasets_json = ncbi_snapshot.get_taxonomy_reports(
+                [tax_id], children=children
+            )
+        # unknown or obsolete taxa are left out instead of failing the query
+        if str(tax_id) not in datasets_json:
+            print(f"[ERROR] Taxon {tax_id} not found ({BACKEND} backend)", file=sys.stderr)
+            sys.exit(1)
+        return datasets_json
+
     datasets_command = [
         "datasets",
         "summary",
@@ -56,6 +107,46 @@ def get_dataset_json(tax_id, children=False):
     return datasets_json
 
 
+def get_dataset_json_batch(tax_ids, batch_size=200):
+    """
+    Same as get_dataset_json without children, but many taxa
+    are requested in each query.
+    """
+    tax_ids = list(dict.fromkeys(str(t) for t in tax_ids))
+
+    if BACKEND == "rest":
+        return ncbi_rest.get_taxonomy_reports(tax_ids)
+    if BACKEND == "snapshot":
+        return ncbi_snapshot.get_taxonomy_reports(tax_ids)
+
+    datasets_json = {}
+    for i in range(0, len(tax_ids), batch_size):
+        datasets_command = ["datasets", "summary", "taxonomy", "taxon"]
+        datasets_command += tax_ids[i : i + batch_size]
+        datasets_command.append("--as-json-lines")
+
+        try:
+            datasets_answer = subprocess.run(
+                datasets_command,
+                check=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except subprocess.CalledProcessError as e:
+            command_str = " ".join(datasets_command)
+            print(f"\n[ERROR] Command failed: {command_str}", file=sys.stderr)
+            print(f"[ERROR] Exit Code: {e.returncode}", file=sys.stderr)
+            print(f"[ERROR] stderr:\n{e.stderr.strip()}", file=sys.stderr)
+            sys.exit(1)
+
+        for line in datasets_answer.stdout.strip().splitlines():
+            entry = json.loads(line)
+            datasets_json[str(entry["taxonomy"]["tax_id"])] = entry
+
+    return datasets_json
+
+
 def get_focus_id_rank(datasets_dict, rank):
 
     rank_id = datasets_dict["taxonomy"]["classification"][rank]["id"]
@@ -78,67 +169,182 @@ def get_focus_id_level(datasets_dict, level):
 
 def get_annotation_count(focus_level, all=False, accept_zero=False):
 
-    datasets_command = [
-        "datasets",
-        "download",
-        "genome",
-        "taxon",
-        focus_level,
-        "--include",
-        "gff3",
-        "--preview",
-        "--annotated",
-    ]
+    if BACKEND == "rest":
+        annotations_count = ncbi_rest.get_genome_count(focus_level, all=all)
+    elif BACKEND == "snapshot":
+        annotations_count = ncbi_snapshot.get_genome_count(focus_level, all=all)
+    else:
+        datasets_command = [
+            "datasets",
+            "download",
+            "genome",
+            "taxon",
+            focus_level,
+            "--include",
+            "gff3",
+            "--preview",
+            "--annotated",
+        ]
 
-    if not all:
-        datasets_command.append("--reference")
+        if not all:
+            datasets_command.append("--reference")
 
-    try:
-        datasets_answer = subprocess.run(
-            datasets_command,
-            check=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        try:
+            datasets_answer = subprocess.run(
+                datasets_command,
+                check=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
 
-    except subprocess.CalledProcessError as e:
-        if accept_zero and "no genome data is currently available" in e.stderr:
-            return 0
+        except subprocess.CalledProcessError as e:
+            if accept_zero and "no genome data is currently available" in e.stderr:
+                return 0
+            else:
+                command_str = " ".join(datasets_command)
+                print(f"\n[ERROR] Command failed: {command_str}", file=sys.stderr)
+                print(f"[ERROR] Exit Code: {e.returncode}", file=sys.stderr)
+                print(f"[ERROR] stderr:\n{e.stderr.strip()}", file=sys.stderr)
+                sys.exit(1)
+
+        try:
+            datasets_json = json.loads(datasets_answer.stdout)
+            annotations_count = datasets_json["included_data_files"]["genome_gff"][
+                "file_count"
+            ]
+        except Exception as e:
+            if accept_zero:
+                return 0
+            else:
+                print(f"[ERROR] Failed to parse datasets output: {e}", file=sys.stderr)
+                print(datasets_answer.stdout)
+                print("[ERROR] Possibly no annotations were found.")
+                print(
+                    "[ERROR] Run get_info.py and select a rank/level with annotations available "
+                )
+                sys.exit(1)
+
+    if annotations_count < 1 and not accept_zero:
+        print("[ERROR] No annotations found. Try higher level or rank")
+        sys.exit(1)
+
+    return annotations_count
+
+
+def get_content_sizes(focus_level, include=DEFAULT_INCLUDE, all=False, accession=False):
+    """
+    Size in MB of each content type available for focus_level, as reported
+    by the datasets download preview. Sizes are 0 when nothing is available.
+    With accession=True focus_level is an assembly accession, or a list of
+    accessions previewed together.
+    """
+    if BACKEND == "snapshot":
+        file_names = {content: CONTENT_TYPES[content]["file"] for content in include}
+        return ncbi_snapshot.get_content_sizes(focus_level, file_names, all, accession)
+    if BACKEND == "rest":
+        preview = ncbi_rest.get_download_summary(
+            focus_level,
+            [CONTENT_TYPES[content]["preview"].upper() for content in include],
+            reference_only=not all,
+            accession=accession,
+        )
+        return get_preview_sizes(preview, include)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if isinstance(focus_level, list):
+            accessions_path = os.path.join(tmp_dir, "accessions.txt")
+            with open(accessions_path, "w") as out_f:
+                out_f.write("\n".join(focus_level) + "\n")
+            target = ["--inputfile", accessions_path]
         else:
+            target = [str(focus_level)]
+
+        datasets_command = [
+            "datasets",
+            "download",
+            "genome",
+            "accession" if accession else "taxon",
+            *target,
+            "--include",
+            ",".join(include),
+            "--preview",
+            "--annotated",
+        ]
+
+        if not all and not accession:
+            datasets_command.append("--reference")
+
+        try:
+            datasets_answer = subprocess.run(
+                datasets_command,
+                check=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+        except subprocess.CalledProcessError as e:
+            if "no genome data is currently available" in e.stderr:
+                return {content: 0.0 for content in include}
             command_str = " ".join(datasets_command)
             print(f"\n[ERROR] Command failed: {command_str}", file=sys.stderr)
             print(f"[ERROR] Exit Code: {e.returncode}", file=sys.stderr)
             print(f"[ERROR] stderr:\n{e.stderr.strip()}", file=sys.stderr)
             sys.exit(1)
 
-    try:
-        datasets_json = json.loads(datasets_answer.stdout)
-        annotations_count = datasets_json["included_data_files"]["genome_gff"][
-            "file_count"
-        ]
-    except Exception as e:
-        if accept_zero:
-            return 0
-        else:
-            print(f"[ERROR] Failed to parse datasets output: {e}", file=sys.stderr)
-            print(datasets_answer.stdout)
-            print("[ERROR] Possibly no annotations were found.")
-            print(
-                "[ERROR] Run get_info.py and select a rank/level with annotations available "
-            )
-            sys.exit(1)
+    return get_preview_sizes(json.loads(datasets_answer.stdout), include)
 
-    if annotations_count < 1 and not accept_zero:
-        print("[ERROR] No annotations found. Try higher level or rank")
+
+def get_preview_sizes(preview, include):
+    """
+    Size in MB of each content type in a download preview.
+    """
+    files_info = preview.get("included_data_files", {})
+
+    sizes = {}
+    for content in include:
+        content_info = files_info.get(CONTENT_TYPES[content]["preview"], {})
+        sizes[content] = float(content_info.get("size_mb", 0))
+    # older previews only report the total
+    if not any(sizes.values()) and len(include) == 1:
+        total = preview.get("hydrated", {}).get("estimated_file_size_mb", 0)
+        sizes[include[0]] = float(preview.get("estimated_file_size_mb", total))
+
+    return sizes
+
+
+def get_annotation_size(focus_level, all=False, accession=False, include=DEFAULT_INCLUDE):
+    """
+    Total size in MB of the included content (the gff3 by default)
+    available for focus_level. Returns 0 when nothing is available.
+    """
+    return sum(get_content_sizes(focus_level, include, all, accession).values())
+
+
+def check_include(include):
+
+    unknown = [content for content in include if content not in CONTENT_TYPES]
+    if unknown:
+        print(f"[ERROR] Unknown content {unknown}, choose from {list(CONTENT_TYPES)}")
         sys.exit(1)
 
-    return annotations_count
+    return list(dict.fromkeys(include))
 
 
 def download_annotation(
-    focus_level, annotations_dir="annotations_ncbi", zip_name="ncbi_dataset.zip"
+    focus_level,
+    annotations_dir="annotations_ncbi",
+    zip_name="ncbi_dataset.zip",
+    accessions=None,
+    include=DEFAULT_INCLUDE,
 ):  # follwing formatting rules caused sad face here
+    """
+    Downloads the reference annotations of focus_level. When a list of
+    accessions is given only those assemblies are downloaded. With more
+    than one content type the package is dehydrated, the files are then
+    fetched in parallel by extract_annotation_zip.
+    """
 
     os.makedirs(annotations_dir, exist_ok=True)
     output_path = os.path.join(annotations_dir, zip_name)
@@ -150,26 +356,56 @@ def download_annotation(
         )
         sys.exit(1)
 
-    datasets_command = [
-        "datasets",
-        "download",
-        "genome",
-        "taxon",
-        focus_level,
-        "--include",
-        "gff3",
-        "--reference",
-        "--annotated",
-        "--filename",
-        output_path,
-    ]
+    if accessions is not None:
+        accessions_path = f"{unzipped_path}_accessions.txt"
+        with open(accessions_path, "w") as out_f:
+            out_f.write("\n".join(accessions) + "\n")
+
+        datasets_command = [
+            "datasets",
+            "download",
+            "genome",
+            "accession",
+            "--inputfile",
+            accessions_path,
+            "--include",
+            ",".join(include),
+            "--filename",
+            output_path,
+        ]
+    else:
+        datasets_command = [
+            "datasets",
+            "download",
+            "genome",
+            "taxon",
+            focus_level,
+            "--include",
+            ",".join(include),
+            "--reference",
+            "--annotated",
+            "--filename",
+            output_path,
+        ]
+
+    if len(include) > 1:
+        datasets_command.append("--dehydrated")
 
     try:
+        if BACKEND == "snapshot":
+            file_names = [CONTENT_TYPES[content]["file"] for content in include]
+            ncbi_snapshot.write_package(output_path, focus_level, accessions, file_names)
+            return output_path
+
         print(f"[INFO] Running command: {subprocess.list2cmdline(datasets_command)}")
         subprocess.run(datasets_command, check=True, text=True)
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] Failed to run datasets download: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        # only needed by the command, not left next to the run
+        if accessions is not None:
+            os.remove(accessions_path)
 
     if not os.path.isfile(output_path):
         print(f"[ERROR] Download failed — {output_path} not found", file=sys.stderr)
@@ -178,28 +414,55 @@ def download_annotation(
     return output_path
 
 
-def extract_annotation_zip(zip_path, extract_to=None):
+def extract_annotation_zip(zip_path, extract_to=None, threads=8):
+    """
+    Extracts a downloaded package and, if it is dehydrated, fetches
+    its files with threads parallel downloads. The archive is removed
+    once its files are all there: if a previous extraction was interrupted
+    during the rehydration, the files are fetched again from the
+    extracted folder (datasets rehydrate skips those already present).
+    """
 
     if extract_to is None:
         extract_to = os.path.splitext(zip_path)[0]
 
-    os.makedirs(extract_to, exist_ok=True)
+    if os.path.isfile(zip_path):
+        os.makedirs(extract_to, exist_ok=True)
+        try:
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                zip_ref.extractall(extract_to)
+            print(f"[INFO] Extracted contents to: {extract_to}")
 
-    try:
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(extract_to)
-        print(f"[INFO] Extracted contents to: {extract_to}")
+        except zipfile.BadZipFile as e:
+            print(f"[ERROR] Invalid ZIP archive: {e}", file=sys.stderr)
+            sys.exit(1)
+        except Exception as e:
+            print(f"[ERROR] Failed during extraction: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif not os.path.isdir(extract_to):
+        print(f"[ERROR] Neither {zip_path} nor {extract_to} found", file=sys.stderr)
+        sys.exit(1)
 
+    if os.path.isfile(os.path.join(extract_to, "ncbi_dataset", "fetch.txt")):
+        rehydrate_command = [
+            "datasets",
+            "rehydrate",
+            "--directory",
+            extract_to,
+            "--max-workers",
+            str(threads),
+        ]
+        try:
+            print(f"[INFO] Running command: {subprocess.list2cmdline(rehydrate_command)}")
+            subprocess.run(rehydrate_command, check=True, text=True)
+        except subprocess.CalledProcessError as e:
+            print(f"[ERROR] Failed to run datasets rehydrate: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    if os.path.isfile(zip_path):
         os.remove(zip_path)
         print(f"[INFO] Removed archive: {zip_path}")
 
-    except zipfile.BadZipFile as e:
-        print(f"[ERROR] Invalid ZIP archive: {e}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"[ERROR] Failed during extraction: {e}", file=sys.stderr)
-        sys.exit(1)
-
     return extract_to
 
 
@@ -255,7 +518,7 @@ def build_annotation_report(base_folder, input_taxid, focus_taxid):
 
     # Get names of annotated assemblies
     assemblies_names = [
-        os.path.splitext(name)[0] for name in os.listdir(annotation_dir)
+        get_flattened_accession(name) for name in os.listdir(annotation_dir)
     ]
 
     # Load full assembly report into a DataFrame
@@ -334,10 +597,22 @@ def add_taxon_distance(annotation_report, input_taxid, focus_taxid):
     return annotation_report_with_distance
 
 
-def flatten_and_rename_gff(base_folder):
+def get_flattened_accession(file_name):
+    """
+    Accession of a flattened file, <accession><suffix> (e.g. GCF_021134715.1.cds.fna).
+    """
+    for content in CONTENT_TYPES.values():
+        if file_name.endswith(content["suffix"]):
+            return file_name[: -len(content["suffix"])]
+
+    return os.path.splitext(file_name)[0]
+
+
+def flatten_and_rename_gff(base_folder, include=DEFAULT_INCLUDE):
     """
     Reorganizes NCBI dataset folder by moving all genomic.gff files
-    into a subfolder called 'annotations', renaming them to their assembly name.
+    (and the other included files) into a subfolder called 'annotations',
+    renaming them to their assembly name and content suffix.
     """
     data_dir = os.path.join(base_folder, "ncbi_dataset", "data")
     annotations_dir = os.path.join(base_folder, "annotations_ncbi")
@@ -355,17 +630,19 @@ def flatten_and_rename_gff(base_folder):
         if not os.path.isdir(entry_path):
             continue
 
-        gff_path = os.path.join(entry_path, "genomic.gff")
-        if os.path.isfile(gff_path):
-            new_name = f"{entry}.gff"
+        for content in include:
+            file_name = CONTENT_TYPES[content]["file"]
+            file_path = os.path.join(entry_path, file_name)
+            new_name = f"{entry}{CONTENT_TYPES[content]['suffix']}"
             dest_path = os.path.join(annotations_dir, new_name)
-            shutil.move(gff_path, dest_path)
+            if os.path.isfile(file_path):
+                shutil.move(file_path, dest_path)
+            elif not os.path.isfile(dest_path):  # moved by an interrupted run
+                print(f"[WARNING] No {file_name} found in {entry}")
 
-            # Remove the now-empty folder
-            if not os.listdir(entry_path):
-                os.rmdir(entry_path)
-        else:
-            print(f"[WARNING] No genomic.gff found in {entry}")
+        # Remove the now-empty folder
+        if not os.listdir(entry_path):
+            os.rmdir(entry_path)
 
     print(f"[INFO] Annotation file(s) moved to: {annotations_dir}")
 
@@ -390,29 +667,260 @@ def get_species_count(children_dataset_dict, parents_id_list):
     return species_count_dict
 
 
-def report_annotation_counts_by_rank(datasets_dict):
+def read_stderr(stderr_f):
+
+    stderr_f.seek(0)
+
+    return stderr_f.read()
+
+
+def check_streamed_command(command, returncode, stderr):
+    """
+    Exits if a streamed command failed. Returns False when it failed
+    only because no genome data is available.
+    """
+    if returncode == 0:
+        return True
+    if "no genome data is currently available" in stderr:
+        return False
+
+    command_str = " ".join(command)
+    print(f"\n[ERROR] Command failed: {command_str}", file=sys.stderr)
+    print(f"[ERROR] Exit Code: {returncode}", file=sys.stderr)
+    print(f"[ERROR] stderr:\n{stderr.strip()}", file=sys.stderr)
+    sys.exit(1)
+
+
+def iter_genome_summary(tax_id):
+    """
+    Streams, one record at a time, the genome summary of all the
+    annotated assemblies available for tax_id.
+    """
+    if BACKEND == "rest":
+        yield from ncbi_rest.iter_genome_reports(tax_id)
+        return
+    if BACKEND == "snapshot":
+        yield from ncbi_snapshot.iter_genome_reports(tax_id)
+        return
+
+    datasets_command = [
+        "datasets",
+        "summary",
+        "genome",
+        "taxon",
+        str(tax_id),
+        "--annotated",
+        "--as-json-lines",
+    ]
+
+    # stderr goes to a file, a full stderr pipe would block the listing
+    with tempfile.TemporaryFile("w+") as stderr_f:
+        with subprocess.Popen(
+            datasets_command,
+            text=True,
+            stdout=subprocess.PIPE,
+            stderr=stderr_f,
+        ) as process:
+            for line in process.stdout:
+                if line.strip():
+                    yield json.loads(line)
+
+        check_streamed_command(datasets_command, process.returncode, read_stderr(stderr_f))
+
+
+def iter_genome_taxa(tax_id):
+    """
+    Streams (organism tax_id, is reference) of the annotated assemblies of
+    tax_id, the only fields needed to count annotations along lineages.
+    With the CLI the records are reduced by dataformat, never parsed here.
+    """
+    if BACKEND != "cli":
+        for report in iter_genome_summary(tax_id):
+            yield str(report["organism"]["tax_id"]), is_reference_genome(report)
+        return
+
+    datasets_command = [
+        "datasets",
+        "summary",
+        "genome",
+        "taxon",
+        str(tax_id),
+        "--annotated",
+        "--as-json-lines",
+    ]
+    dataformat_command = [
+        "dataformat",
+        "tsv",
+        "genome",
+        "--fields",
+        "organism-tax-id,assminfo-refseq-category",
+        "--elide-header",
+    ]
+
+    with tempfile.TemporaryFile("w+") as datasets_err, tempfile.TemporaryFile(
+        "w+"
+    ) as dataformat_err:
+        datasets_process = subprocess.Popen(
+            datasets_command, stdout=subprocess.PIPE, stderr=datasets_err
+        )
+        with subprocess.Popen(
+            dataformat_command,
+            text=True,
+            stdin=datasets_process.stdout,
+            stdout=subprocess.PIPE,
+            stderr=dataformat_err,
+        ) as dataformat_process:
+            datasets_process.stdout.close()  # only dataformat reads it
+            for line in dataformat_process.stdout:
+                organism_tax_id, _, category = line.rstrip("\n").partition("\t")
+                if organism_tax_id:
+                    yield organism_tax_id, category == "reference genome"
+        datasets_process.wait()
+
+        if check_streamed_command(
+            datasets_command, datasets_process.returncode, read_stderr(datasets_err)
+        ):
+            check_streamed_command(
+                dataformat_command,
+                dataformat_process.returncode,
+                read_stderr(dataformat_err),
+            )
+
+
+def is_reference_genome(genome_report):
+
+    category = genome_report.get("assembly_info", {}).get("refseq_category", "")
+
+    return category == "reference genome"
+
+
+def get_lineages(tax_ids, known_dataset_dict=None):
+    """
+    Returns a dictionary with the set of ancestors (taxon included) of each
+    tax_id. Taxa already in known_dataset_dict are not queried again,
+    the remaining ones are fetched in batches.
+    """
+    known_dataset_dict = known_dataset_dict or {}
+    tax_ids = {str(t) for t in tax_ids}
+
+    missing = [t for t in tax_ids if t not in known_dataset_dict]
+    fetched = get_dataset_json_batch(missing) if missing else {}
+
+    lineages = {}
+    for tax_id in tax_ids:
+        entry = known_dataset_dict.get(tax_id, fetched.get(tax_id))
+        if entry is None:
+            print(f"[WARNING] No taxonomy found for {tax_id}")
+            continue
+        parents = entry["taxonomy"].get("parents", [])
+        lineages[tax_id] = {str(p) for p in parents} | {tax_id}
+
+    return lineages
+
+
+def get_assembly_count(dataset_dict):
+
+    counts = dataset_dict.get("taxonomy", {}).get("counts", [])
+
+    return next((c["count"] for c in counts if c["type"] == "COUNT_TYPE_ASSEMBLY"), 0)
+
+
+def get_annotation_counts_by_lineage(
+    target_ids, known_dataset_dict=None, all=True, threads=8
+):
+    """
+    Counts, for each of the target_ids, the reference and (if all is True)
+    total annotations of its descendants. Targets with at most
+    LISTING_MAX_ASSEMBLIES assemblies are grouped under the highest of them,
+    whose annotated assemblies are streamed once (taxonomy ids only) and
+    joined to the targets along their lineages. Larger targets, whose listing
+    would be huge, get one preview per count instead.
+    Lineages are joined locally, using known_dataset_dict when available.
+    """
+    target_ids = list(dict.fromkeys(str(t) for t in target_ids))
+    known_dataset_dict = known_dataset_dict or {}
+
+    # counts of the ancestors of the exported clades are stored in the snapshot
+    if BACKEND == "snapshot":
+        return get_annotation_counts(target_ids, all=all, threads=threads)
+
+    missing = [t for t in target_ids if t not in known_dataset_dict]
+    target_dicts = get_dataset_json_batch(missing) if missing else {}
+    target_dicts.update(
+        {t: known_dataset_dict[t] for t in target_ids if t in known_dataset_dict}
+    )
+
+    listed = {
+        t
+        for t in target_ids
+        if t in target_dicts
+        and get_assembly_count(target_dicts[t]) <= LISTING_MAX_ASSEMBLIES
+    }
+    tops = [
+        t
+        for t in target_ids
+        if t in listed
+        and not listed.intersection(
+            str(p) for p in target_dicts[t]["taxonomy"].get("parents", [])
+        )
+    ]
+
+    counts = {
+        t: {"annotation_count_ref": 0, "annotation_count_all": 0} for t in listed
+    }
+    for top in tops:
+        genomes = list(iter_genome_taxa(top))
+        print(f"[INFO] {len(genomes)} annotated assemblies found for {top}")
+
+        lineages = get_lineages({t for t, _ in genomes}, known_dataset_dict)
+        for tax_id, reference in genomes:
+            for target in lineages.get(tax_id, set()).intersection(counts):
+                counts[target]["annotation_count_all"] += 1
+                if reference:
+                    counts[target]["annotation_count_ref"] += 1
+
+    previewed = [t for t in target_ids if t not in listed]
+    if previewed:
+        counts.update(get_annotation_counts(previewed, all=all, threads=threads))
+
+    return counts
+
+
+def report_annotation_counts_by_rank(datasets_dict, counts=None):
     """
     Takes a dataset dictionary of a specic taxon and
-    retunr simple statistics
+    retunr simple statistics. Annotation counts already
+    known (see get_annotation_counts) can be given as counts.
     """
     lineage = datasets_dict["taxonomy"]["classification"]
     parents = datasets_dict["taxonomy"]["parents"]
     report = []
     ranks = ["SPECIES", "GENUS", "FAMILY", "ORDER", "CLASS", "PHYLUM", "KINGDOM"]
 
+    available_ranks = []
     for rank in ranks:
-        rank_lower = rank.lower()
-        if rank_lower not in lineage:
+        if rank.lower() not in lineage:
             print(f"[INFO] {rank} information not found")
             continue
-        taxon_info = lineage[rank_lower]
+        available_ranks.append(rank)
+
+    if not available_ranks:
+        return report
+
+    # count annotations of all ranks from the listing of the highest one
+    rank_ids = [str(lineage[rank.lower()]["id"]) for rank in available_ranks]
+    if counts is None:
+        counts = get_annotation_counts_by_lineage(rank_ids, all=False)
+
+    for rank in available_ranks:
+        taxon_info = lineage[rank.lower()]
         taxon_id = str(taxon_info["id"])
         taxon_name = taxon_info["name"]
         taxon_level = (
             list(reversed(parents)).index(int(taxon_id)) + 1 if rank != "SPECIES" else 0
         )  # adding one otherise genus would be 0
 
-        count = get_annotation_count(taxon_id, accept_zero=True)
+        count = counts[taxon_id]["annotation_count_ref"]
         report.append(
             {
                 "rank": rank,
@@ -423,13 +931,21 @@ def report_annotation_counts_by_rank(datasets_dict):
             }
         )
 
-        time.sleep(0.3)  # be nice to NCBI
-
     return report
 
 
-def report_annotation_counts_by_parents(datasets_dict, max_parents=6):
-
+def report_annotation_counts_by_parents(
+    datasets_dict,
+    max_parents=6,
+    children_dataset_dict=None,
+    species_count=None,
+    counts=None,
+):
+    """
+    Annotation, assembly and species counts of the last max_parents parents
+    of a taxon, closest first. The children of the highest parent, the
+    species counts and the annotation counts are fetched unless given.
+    """
     parent_info = []
 
     input_taxid = datasets_dict["taxonomy"]["tax_id"]
@@ -449,8 +965,11 @@ def report_annotation_counts_by_parents(datasets_dict, max_parents=6):
                 f"[WARNING] Only {len(parent_ids)} parent taxa available (less than {max_parents})"
             )
         # get species count for each parent, use the highest level
-        children_dataset_dict = get_dataset_json(selected_parents[0], children=True)
-        species_count = get_species_count(children_dataset_dict, selected_parents)
+        if children_dataset_dict is None:
+            children_dataset_dict = get_dataset_json(selected_parents[0], children=True)
+        if species_count is None:
+            species_count = get_species_count(children_dataset_dict, selected_parents)
+        species_count = dict(species_count)
         # Add species taxid as is required for annotaion count
         selected_parents.append(str(input_taxid))
         # Add artificial 1 to species count, this do not accout for subspecies
@@ -461,22 +980,22 @@ def report_annotation_counts_by_parents(datasets_dict, max_parents=6):
         species_count = {str(input_taxid): 1}
 
     print(f"[INFO] Reporting info for {selected_parents}")
-    if len(selected_parents) > 5:
-        print("[INFO] High -e values may require long time to compute")
+
+    # one listing of the highest (not too large) parent counts all the levels below
+    if counts is None:
+        counts = get_annotation_counts_by_lineage(
+            selected_parents, children_dataset_dict
+        )
+    annotation_counts = counts
 
     for pid in reversed(selected_parents):  # Closest parent first
         pid_str = str(pid)
-        annotation_count_ref = get_annotation_count(pid_str, accept_zero=True)
-        annotation_count_all = get_annotation_count(pid_str, all=True, accept_zero=True)
+        annotation_count_ref = annotation_counts[pid_str]["annotation_count_ref"]
+        annotation_count_all = annotation_counts[pid_str]["annotation_count_all"]
         pid_dict = children_dataset_dict[pid_str]
 
         taxonomy = pid_dict.get("taxonomy", {})
-        counts = taxonomy.get("counts", [])
-
-        # Get assembly count
-        assembly_count = next(
-            (c["count"] for c in counts if c["type"] == "COUNT_TYPE_ASSEMBLY"), 0
-        )
+        assembly_count = get_assembly_count(pid_dict)
         rank = taxonomy.get("rank", "").upper()
         name = taxonomy.get("current_scientific_name", {}).get("name", "")
 
@@ -492,6 +1011,137 @@ def report_annotation_counts_by_parents(datasets_dict, max_parents=6):
             }
         )
 
-        time.sleep(0.3)
-
     return parent_info
+
+
+def get_annotation_counts(tax_ids, all=True, threads=8):
+    """
+    Reference (and, if all is True, total) annotation counts of each
+    distinct taxon, queried concurrently, one taxon per request.
+    """
+    tax_ids = list(dict.fromkeys(str(t) for t in tax_ids))
+
+    def count(tax_id):
+        counts = {
+            "annotation_count_ref": get_annotation_count(tax_id, accept_zero=True)
+        }
+        if all:
+            counts["annotation_count_all"] = get_annotation_count(
+                tax_id, all=True, accept_zero=True
+            )
+        return counts
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return dict(zip(tax_ids, pool.map(count, tax_ids)))
+
+
+def get_report_taxa(datasets_dict, max_parents=None):
+    """
+    Taxa reported for datasets_dict: its ranks (report_annotation_counts_by_rank)
+    or, when max_parents is given, its last max_parents parents and itself.
+    """
+    taxonomy = datasets_dict["taxonomy"]
+    if max_parents is None:
+        lineage = taxonomy["classification"]
+        ranks = ["species", "genus", "family", "order", "class", "phylum", "kingdom"]
+        return [str(lineage[r]["id"]) for r in ranks if r in lineage]
+
+    parents = [str(p) for p in taxonomy.get("parents", [])]
+    selected = parents[-max_parents:] if max_parents > 0 else []
+
+    return selected + [str(taxonomy["tax_id"])]
+
+
+def report_annotation_counts_batch(datasets_dicts, max_parents=None, threads=8):
+    """
+    Reports of many taxa at once (by rank, or by parents when max_parents
+    is given). Closely related taxa share most of their ancestors, so the
+    union of the lineages is counted at once (get_annotation_counts_by_lineage):
+    inputs under the same highest listed ancestor share one listing.
+    Returns {taxid: report}.
+    """
+    report_taxa = {
+        t: get_report_taxa(d, max_parents) for t, d in datasets_dicts.items()
+    }
+    all_taxa = set().union(*report_taxa.values())
+    print(f"[INFO] {len(all_taxa)} distinct taxa for {len(datasets_dicts)} inputs")
+
+    known_dataset_dict = {str(t): d for t, d in datasets_dicts.items()}
+    children_dataset_dict, species_count = None, None
+    if max_parents is not None and max_parents > 0:
+        # the subtree of each distinct highest parent, for names and species
+        tops = list(dict.fromkeys(taxa[0] for taxa in report_taxa.values()))
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            subtrees = pool.map(lambda t: get_dataset_json(t, children=True), tops)
+        children_dataset_dict = {}
+        for subtree in subtrees:
+            children_dataset_dict.update(subtree)
+        species_count = get_species_count(children_dataset_dict, all_taxa)
+        known_dataset_dict.update(children_dataset_dict)
+
+    counts = get_annotation_counts_by_lineage(
+        all_taxa, known_dataset_dict, all=max_parents is not None, threads=threads
+    )
+
+    reports = {}
+    for tax_id, datasets_dict in datasets_dicts.items():
+        if max_parents is None:
+            reports[tax_id] = report_annotation_counts_by_rank(datasets_dict, counts)
+        else:
+            reports[tax_id] = report_annotation_counts_by_parents(
+                datasets_dict, max_parents, children_dataset_dict, species_count, counts
+            )
+
+    return reports
+
+
+def add_download_sizes(atlas, include=DEFAULT_INCLUDE, threads=8):
+    """
+    Adds to each entry of the availability atlas the size in GB of the
+    download of its reference annotations, previewed concurrently.
+    Entries without reference annotations have nothing to download.
+    """
+
+    def size_gb(entry):
+        if entry["annotation_count_ref"] < 1:
+            return 0.0
+        return get_annotation_size(entry["taxon_id"], include=include) / 1024
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for entry, size in zip(atlas, pool.map(size_gb, atlas)):
+            entry["download_size_gb"] = round(size, 3)
+
+    return atlas
+
+
+def select_focus_from_atlas(
+    atlas, min_annotations=1, max_gb=None, include=DEFAULT_INCLUDE
+):
+    """
+    Takes the availability atlas from report_annotation_counts_by_parents
+    (closest taxon first) and returns the entry of the closest ancestor with
+    at least min_annotations reference annotations and, when max_gb is given,
+    a download not larger than max_gb. Sizes already in the atlas (see
+    add_download_sizes) are not previewed again. Returns None if no
+    ancestor qualifies.
+    """
+    for entry in atlas:
+        if entry["annotation_count_ref"] < min_annotations:
+            continue
+
+        # download size only grows going up, so the first candidate decides
+        if max_gb is not None:
+            if "download_size_gb" not in entry:
+                size_gb = get_annotation_size(entry["taxon_id"], include=include) / 1024
+                entry["download_size_gb"] = round(size_gb, 3)
+            size_gb = entry["download_size_gb"]
+            if size_gb > max_gb:
+                print(
+                    f"[INFO] {entry['name']} ({entry['taxon_id']}) has enough annotations "
+                    f"but {size_gb:.2f} GB exceed the {max_gb} GB limit"
+                )
+                return None
+
+        return entry
+
+    return None
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import quote, urlencode, urlsplit
+
+# The base url can point to a local stand-in server for testing,
+# e.g. NCBI_DATASETS_API_URL=http://127.0.0.1:8000/datasets/v2
+DEFAULT_API_URL = "https://api.ncbi.nlm.nih.gov/datasets/v2"
+
+# Number of taxa sent in a single taxonomy dataset_report request
+TAXON_BATCH_SIZE = 200
+PAGE_SIZE = 1000
+MAX_RETRIES = 3
+
+# One keep-alive connection per thread, reused by every request
+_local = threading.local()
+
+
+def get_api_url():
+
+    return os.environ.get("NCBI_DATASETS_API_URL", DEFAULT_API_URL).rstrip("/")
+
+
+def get_connection():
+    """
+    Returns the pooled connection of the current thread and the base path
+    of the API. The connection is only opened again if the API url changes
+    or the server drops it.
+    """
+    url = urlsplit(get_api_url())
+    key = (url.scheme, url.netloc)
+
+    if getattr(_local, "key", None) != key:
+        if getattr(_local, "connection", None) is not None:
+            _local.connection.close()
+        if url.scheme == "https":
+            _local.connection = http.client.HTTPSConnection(url.netloc, timeout=120)
+        else:
+            _local.connection = http.client.HTTPConnection(url.netloc, timeout=120)
+        _local.key = key
+
+    return _local.connection, url.path
+
+
+def close_connection():
+
+    if getattr(_local, "connection", None) is not None:
+        _local.connection.close()
+    _local.connection = None
+    _local.key = None
+
+
+def api_request(endpoint, params=None, payload=None):
+    """
+    Sends a GET (or a POST when payload is given) request to the Datasets API
+    and returns the decoded json answer. Busy/failed requests are retried on
+    the same connection, anything else is reported as an error.
+    """
+    connection, base_path = get_connection()
+    path = base_path + endpoint
+    if params:
+        path += "?" + urlencode(params, doseq=True)
+
+    headers = {"Accept": "application/json", "Connection": "keep-alive"}
+    api_key = os.environ.get("NCBI_API_KEY")
+    if api_key:
+        headers["api-key"] = api_key
+
+    method, body = "GET", None
+    if payload is not None:
+        method, body = "POST", json.dumps(payload)
+        headers["Content-Type"] = "application/json"
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            answer = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            # stale keep-alive connections are closed and reopened on next request
+            connection.close()
+            error = str(e)
+        else:
+            if response.status == 200:
+                return json.loads(answer) if answer.strip() else {}
+            error = f"HTTP {response.status}: {answer.decode(errors='replace').strip()}"
+            if response.status != 429 and response.status < 500:
+                break
+
+        if attempt < MAX_RETRIES:
+            time.sleep(attempt)  # be nice to NCBI
+
+    print(f"\n[ERROR] Request failed: {method} {path}", file=sys.stderr)
+    print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1)
+
+
+def iter_reports(endpoint, params=None, payload=None):
+    """
+    Yields the reports of a paginated dataset_report endpoint,
+    following next_page_token until the listing is exhausted.
+    """
+    params = dict(params or {})
+    payload = dict(payload) if payload is not None else None
+
+    while True:
+        answer = api_request(endpoint, params=params, payload=payload)
+        for report in answer.get("reports", []):
+            yield report
+
+        page_token = answer.get("next_page_token")
+        if not page_token:
+            break
+        if payload is not None:
+            payload["page_token"] = page_token
+        else:
+            params["page_token"] = page_token
+
+
+def get_taxonomy_reports(tax_ids, children=False):
+    """
+    Same output as get_dataset_json in ncbi_requests, a dictionary with one
+    key per tax_id, but many taxa are requested at once.
+    """
+    tax_ids = [str(t) for t in tax_ids]
+    datasets_json = {}
+
+    for i in range(0, len(tax_ids), TAXON_BATCH_SIZE):
+        payload = {
+            "taxons": tax_ids[i : i + TAXON_BATCH_SIZE],
+            "children": children,
+            "page_size": PAGE_SIZE,
+        }
+        for report in iter_reports("/taxonomy/dataset_report", payload=payload):
+            # unknown taxa come back as reports with errors only
+            if "taxonomy" not in report:
+                continue
+            datasets_json[str(report["taxonomy"]["tax_id"])] = report
+
+    return datasets_json
+
+
+def get_genome_count(tax_id, all=False):
+    """
+    Number of annotated assemblies (so gff files) available for tax_id,
+    only reference assemblies unless all is True.
+    """
+    params = {
+        "filters.has_annotation": "true",
+        "returned_content": "ASSM_ACC",
+        "page_size": 1,
+    }
+    if not all:
+        params["filters.reference_only"] = "true"
+
+    endpoint = f"/genome/taxon/{quote(str(tax_id))}/dataset_report"
+    answer = api_request(endpoint, params=params)
+
+    return int(answer.get("total_count", 0))
+
+
+def iter_genome_reports(tax_id, all=True):
+    """
+    Streams the genome summary reports of the annotated assemblies of tax_id,
+    same records as `datasets summary genome taxon --annotated --as-json-lines`.
+    """
+    params = {"filters.has_annotation": "true", "page_size": PAGE_SIZE}
+    if not all:
+        params["filters.reference_only"] = "true"
+
+    endpoint = f"/genome/taxon/{quote(str(tax_id))}/dataset_report"
+
+    yield from iter_reports(endpoint, params=params)
+
+
+def get_download_summary(
+    focus_level, annotation_types, reference_only=True, accession=False
+):
+    """
+    Preview of a genome download, the same json as `datasets download genome
+    --preview`: number of records and size of each included file type.
+    A list of accessions is previewed at once.
+    """
+    params = {"include_annotation_type": list(annotation_types)}
+    if accession and isinstance(focus_level, list):
+        payload = {
+            "accessions": focus_level,
+            "include_annotation_type": list(annotation_types),
+        }
+        return api_request("/genome/download_summary", payload=payload)
+    if accession:
+        endpoint = f"/genome/accession/{quote(str(focus_level))}/download_summary"
+    else:
+        endpoint = f"/genome/taxon/{quote(str(focus_level))}/download_summary"
+        params["filters.has_annotation"] = "true"
+        if reference_only:
+            params["filters.reference_only"] = "true"
+
+    return api_request(endpoint, params=params)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+import utils.ncbi_requests as ncbi_requests
+
+
+def get_lca(input_lineage, lineage):
+    """
+    Takes the lineage of the input taxon (root first, taxon last) and the
+    set of ancestors of another taxon. Returns the last common ancestor
+    and its depth, the number of levels above the input taxon.
+    """
+    for depth, taxon in enumerate(reversed(input_lineage)):
+        if taxon in lineage:
+            return taxon, depth
+
+    return None, None
+
+
+def lineages_in_order(dataset_dict, tax_id):
+    """
+    Lineage of tax_id as an ordered list, root first and tax_id last.
+    """
+    tax_id = str(tax_id)
+    if tax_id not in dataset_dict:
+        dataset_dict = ncbi_requests.get_dataset_json(tax_id)
+
+    parents = dataset_dict[tax_id]["taxonomy"].get("parents", [])
+
+    return [str(p) for p in parents] + [tax_id]
+
+
+def list_candidates(focus_taxid, input_taxid, focus_with_children=None):
+    """
+    Lists the reference annotated assemblies of focus_taxid with the metadata
+    used for selection and their distance from input_taxid, closest first.
+    Nothing is downloaded at this stage.
+    """
+    focus_taxid = str(focus_taxid)
+    input_taxid = str(input_taxid)
+
+    if focus_with_children is None:
+        focus_with_children = ncbi_requests.get_dataset_json(focus_taxid, children=True)
+
+    candidates = []
+    for report in ncbi_requests.iter_genome_summary(focus_taxid):
+        if not ncbi_requests.is_reference_genome(report):
+            continue
+        annotation_info = report.get("annotation_info", {})
+        candidates.append(
+            {
+                "Assembly_Accession": report["accession"],
+                "Organism_Name": report.get("organism", {}).get("organism_name", ""),
+                "Organism_Taxonomic_ID": str(report["organism"]["tax_id"]),
+                "Annotation_Provider": annotation_info.get("provider", ""),
+                "Annotation_Release_Date": annotation_info.get("release_date", ""),
+                "Annotation_BUSCO_Complete": annotation_info.get("busco", {}).get(
+                    "complete"
+                ),
+            }
+        )
+
+    if not candidates:
+        return pd.DataFrame(candidates)
+
+    lineages = ncbi_requests.get_lineages(
+        [c["Organism_Taxonomic_ID"] for c in candidates], focus_with_children
+    )
+    input_lineage = lineages_in_order(focus_with_children, input_taxid)
+
+    for candidate in candidates:
+        lineage = lineages.get(candidate["Organism_Taxonomic_ID"], set())
+        lca_taxid, lca_depth = get_lca(input_lineage, lineage)
+        candidate["lca_taxid"] = lca_taxid
+        candidate["lca_depth"] = lca_depth
+
+    df = pd.DataFrame(candidates)
+    df = df.sort_values(
+        ["lca_depth", "Annotation_BUSCO_Complete"],
+        ascending=[True, False],
+        na_position="last",
+    ).reset_index(drop=True)
+
+    return df
+
+
+def get_quality_order(candidates):
+    """
+    Index of the candidates, best annotation first: RefSeq, then higher
+    BUSCO complete, then closer to the input taxon.
+    """
+    ordered = candidates.assign(
+        refseq=candidates["Assembly_Accession"].str.startswith("GCF_")
+    ).sort_values(
+        ["refseq", "Annotation_BUSCO_Complete", "lca_depth"],
+        ascending=[False, False, True],
+        na_position="last",
+        kind="stable",
+    )
+
+    return ordered.index
+
+
+def get_rank_ancestor(lineage, dataset_dict, rank):
+
+    for taxon in lineage:
+        taxon_rank = dataset_dict.get(taxon, {}).get("taxonomy", {}).get("rank", "")
+        if taxon_rank.upper() == rank.upper():
+            return taxon
+
+    return None
+
+
+def sample_per_rank(candidates, dataset_dict, rank="genus", per_rank=1):
+    """
+    Keeps at most per_rank candidates for each taxon of the given rank
+    (e.g. genus), the best annotations first. Returns the kept index,
+    closest first.
+    """
+    lineages = ncbi_requests.get_lineages(
+        candidates["Organism_Taxonomic_ID"], dataset_dict
+    )
+    groups = candidates["Organism_Taxonomic_ID"].map(
+        lambda t: get_rank_ancestor(lineages.get(t, set()), dataset_dict, rank)
+    )
+
+    # focus at or below rank: all the candidates share the same ancestor
+    groups = groups.fillna("")
+    ordered = get_quality_order(candidates)
+    ordered_groups = groups.loc[ordered]
+    kept = set(ordered_groups.groupby(ordered_groups, sort=False).head(per_rank).index)
+
+    return [i for i in candidates.index if i in kept]
+
+
+def sample_diverse(candidates, dataset_dict, n):
+    """
+    Greedy diversity maximising subset of n candidates: starting from the
+    closest one, each step adds the candidate farthest (in taxonomic levels
+    through the last common ancestor) from the ones already chosen. Ties
+    go to the best annotation. Returns the kept index in selection order.
+    """
+    lineages = ncbi_requests.get_lineages(
+        candidates["Organism_Taxonomic_ID"], dataset_dict
+    )
+    ordered = list(get_quality_order(candidates))
+    ordered.remove(candidates.index[0])
+    ordered.insert(0, candidates.index[0])
+
+    taxa = [
+        lineages.get(t, set())
+        for t in candidates.loc[ordered, "Organism_Taxonomic_ID"]
+    ]
+    sizes = np.array([len(t) for t in taxa])
+
+    def distances_from(j):
+        shared = np.array([len(taxa[j] & t) for t in taxa])
+        return sizes[j] + sizes - 2 * shared
+
+    chosen = [0]
+    min_distance = distances_from(0).astype(float)
+    min_distance[0] = -1
+    while len(chosen) < min(n, len(ordered)):
+        j = int(np.argmax(min_distance))  # first maximum, so best quality
+        chosen.append(j)
+        min_distance = np.minimum(min_distance, distances_from(j))
+        min_distance[chosen] = -1
+
+    return [ordered[j] for j in chosen]
+
+
+def get_prefix_within_budget(accessions, budget_mb, include):
+    """
+    Length and size in MB of the longest prefix of accessions whose
+    download fits in budget_mb. Sizes only grow with the prefix, so it is
+    found by bisection, previewing each tried prefix in one batched call:
+    about log2(n) previews instead of one per accession.
+    """
+    sizes = {0: 0.0}
+
+    def prefix_size(n):
+        if n not in sizes:
+            sizes[n] = ncbi_requests.get_annotation_size(
+                accessions[:n], accession=True, include=include
+            )
+        return sizes[n]
+
+    low, high = 0, len(accessions)
+    if prefix_size(high) <= budget_mb:
+        return high, sizes[high]
+
+    # prefix_size(low) fits, prefix_size(high) does not
+    while high - low > 1:
+        middle = (low + high) // 2
+        if prefix_size(middle) <= budget_mb:
+            low = middle
+        else:
+            high = middle
+
+    return low, sizes[low]
+
+
+def filter_candidates(
+    candidates,
+    max_count=None,
+    max_lca_depth=None,
+    min_busco=None,
+    providers=None,
+    released_after=None,
+    max_gb=None,
+    dataset_dict=None,
+    sample_rank="genus",
+    per_rank=None,
+    diverse=None,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+):
+    """
+    Applies the selection filters to the candidates table (closest first)
+    and returns it with a "selected" column. Representative sampling
+    (per_rank or diverse, using the lineages in dataset_dict) runs on what
+    passes the filters. The byte budget is checked last, on the download
+    size of the included content (see get_prefix_within_budget).
+    """
+    candidates = candidates.copy()
+    keep = pd.Series(True, index=candidates.index)
+
+    if max_lca_depth is not None:
+        keep &= candidates["lca_depth"] <= max_lca_depth
+    if min_busco is not None:
+        keep &= candidates["Annotation_BUSCO_Complete"].fillna(0) >= min_busco
+    if providers:
+        providers = [p.lower() for p in providers]
+        keep &= candidates["Annotation_Provider"].str.lower().isin(providers)
+    if released_after is not None:
+        keep &= candidates["Annotation_Release_Date"] >= released_after
+
+    selected = candidates.index[keep]
+    if per_rank is not None:
+        selected = sample_per_rank(
+            candidates.loc[selected], dataset_dict, sample_rank, per_rank
+        )
+    if diverse is not None and len(selected) > 0:
+        selected = sample_diverse(candidates.loc[selected], dataset_dict, diverse)
+    if max_count is not None:
+        selected = selected[:max_count]
+
+    if max_gb is not None:
+        accessions = list(candidates.loc[selected, "Assembly_Accession"])
+        n, size_mb = get_prefix_within_budget(accessions, max_gb * 1024, include)
+        print(
+            f"[INFO] {n} of {len(accessions)} selected assemblies fit in "
+            f"{max_gb} GB ({size_mb / 1024:.2f} GB)"
+        )
+        selected = list(selected)[:n]
+
+    candidates["selected"] = candidates.index.isin(selected)
+
+    return candidates
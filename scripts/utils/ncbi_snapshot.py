@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import zipfile
+import zlib
+from urllib.parse import quote
+
+# A snapshot is a single SQLite file with everything the queries of
+# ncbi_requests need for a set of clades, so that nodes without network
+# can mount it read-only, e.g. PHYLOCONTEXT_SNAPSHOT=/data/arthropoda.sqlite
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = os.environ.get("PHYLOCONTEXT_SNAPSHOT")
+
+SCHEMA = [
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE clades (tax_id TEXT PRIMARY KEY)",
+    # taxonomy summaries of the clades, their descendants and their ancestors
+    "CREATE TABLE taxonomy (tax_id TEXT PRIMARY KEY, report TEXT)",
+    "CREATE TABLE lineage (tax_id TEXT, ancestor TEXT)",
+    "CREATE INDEX idx_lineage_ancestor ON lineage (ancestor)",
+    "CREATE TABLE counts (tax_id TEXT PRIMARY KEY, "
+    "annotation_count_ref INTEGER, annotation_count_all INTEGER)",
+    # genome summaries of the annotated assemblies
+    "CREATE TABLE genomes (accession TEXT PRIMARY KEY, tax_id TEXT, "
+    "reference INTEGER, report TEXT)",
+    "CREATE INDEX idx_genomes_tax_id ON genomes (tax_id)",
+    # downloaded packages, when exported with their files
+    "CREATE TABLE packages (accession TEXT PRIMARY KEY, record TEXT)",
+    "CREATE TABLE files (accession TEXT, name TEXT, md5 TEXT, size INTEGER, "
+    "data BLOB, PRIMARY KEY (accession, name))",
+]
+
+# One read-only connection per thread
+_local = threading.local()
+
+
+def set_snapshot(snapshot_path):
+
+    global SNAPSHOT_PATH
+    if not os.path.isfile(snapshot_path):
+        print(f"[ERROR] Snapshot not found: {snapshot_path}")
+        sys.exit(1)
+    SNAPSHOT_PATH = snapshot_path
+    _local.connection = None
+
+    version = int(get_meta()["version"])
+    if version != SNAPSHOT_VERSION:
+        print(
+            f"[ERROR] Snapshot {snapshot_path} has version {version}, "
+            f"version {SNAPSHOT_VERSION} is supported"
+        )
+        sys.exit(1)
+
+
+def get_connection():
+    """
+    Opens the snapshot read-only and immutable: nothing is ever written
+    next to it, so it can live on a read-only mount.
+    """
+    if SNAPSHOT_PATH is None:
+        print("[ERROR] No snapshot given, use --snapshot or PHYLOCONTEXT_SNAPSHOT")
+        sys.exit(1)
+
+    if getattr(_local, "path", None) != SNAPSHOT_PATH or _local.connection is None:
+        uri = f"file:{quote(os.path.abspath(SNAPSHOT_PATH))}?mode=ro&immutable=1"
+        _local.connection = sqlite3.connect(uri, uri=True)
+        _local.path = SNAPSHOT_PATH
+
+    return _local.connection
+
+
+def create_snapshot(snapshot_path):
+
+    con = sqlite3.connect(snapshot_path)
+    for statement in SCHEMA:
+        con.execute(statement)
+
+    return con
+
+
+def get_meta():
+
+    rows = get_connection().execute("SELECT key, value FROM meta")
+
+    return dict(rows)
+
+
+def in_clades(con, tax_id):
+
+    row = con.execute(
+        "SELECT 1 FROM clades WHERE tax_id = ? OR tax_id IN "
+        "(SELECT ancestor FROM lineage WHERE tax_id = ?)",
+        (tax_id, tax_id),
+    ).fetchone()
+
+    return row is not None
+
+
+def check_subtree(con, tax_id):
+    """
+    Genomes are listed only inside the exported clades.
+    """
+    if not in_clades(con, tax_id):
+        print(
+            f"[ERROR] Descendants of {tax_id} not in snapshot {SNAPSHOT_PATH}, "
+            "export a snapshot with it (or one of its parents) as clade"
+        )
+        sys.exit(1)
+
+
+def get_taxonomy_reports(tax_ids, children=False):
+    """
+    Same output as get_dataset_json in ncbi_requests, from the snapshot.
+    """
+    con = get_connection()
+    datasets_json = {}
+
+    for tax_id in dict.fromkeys(str(t) for t in tax_ids):
+        row = con.execute(
+            "SELECT report FROM taxonomy WHERE tax_id = ?", (tax_id,)
+        ).fetchone()
+        if row is None:
+            print(f"[WARNING] Taxon {tax_id} not in snapshot {SNAPSHOT_PATH}")
+            continue
+        datasets_json[tax_id] = json.loads(row[0])
+
+        if children:
+            # ancestors of the clades only have the exported descendants
+            if not in_clades(con, tax_id):
+                print(
+                    f"[WARNING] Only the descendants of {tax_id} in the exported "
+                    f"clades are in snapshot {SNAPSHOT_PATH}, species counts are partial"
+                )
+            descendants = con.execute(
+                "SELECT t.tax_id, t.report FROM lineage l "
+                "JOIN taxonomy t ON t.tax_id = l.tax_id WHERE l.ancestor = ?",
+                (tax_id,),
+            )
+            for child_id, report in descendants:
+                datasets_json[child_id] = json.loads(report)
+
+    return datasets_json
+
+
+def get_genome_count(tax_id, all=False):
+
+    row = (
+        get_connection()
+        .execute(
+            "SELECT annotation_count_ref, annotation_count_all FROM counts "
+            "WHERE tax_id = ?",
+            (str(tax_id),),
+        )
+        .fetchone()
+    )
+    if row is None:
+        print(
+            f"[ERROR] No annotation count for {tax_id} in snapshot {SNAPSHOT_PATH}, "
+            "export a snapshot including its clade"
+        )
+        sys.exit(1)
+
+    return row[1] if all else row[0]
+
+
+def get_subtree_genomes(tax_id, reference_only=False, partial=False):
+    """
+    Accession and report of the annotated assemblies of tax_id and its
+    descendants. Exits for taxa above the exported clades unless partial
+    listings (only the assemblies of the clades) are accepted.
+    """
+    query = (
+        "SELECT accession, report FROM genomes WHERE (tax_id = ? OR tax_id IN "
+        "(SELECT tax_id FROM lineage WHERE ancestor = ?))"
+    )
+    if reference_only:
+        query += " AND reference = 1"
+
+    con = get_connection()
+    if not partial:
+        check_subtree(con, str(tax_id))
+
+    return con.execute(query, (str(tax_id), str(tax_id))).fetchall()
+
+
+def iter_genome_reports(tax_id, all=True):
+
+    for _, report in get_subtree_genomes(tax_id, reference_only=not all):
+        yield json.loads(report)
+
+
+def get_package_accessions(
+    focus_level, accessions=None, all=False, accession=False, partial=False
+):
+    """
+    Accessions a download would include: the given ones, a single
+    accession, or the reference (or all) assemblies of a taxon.
+    """
+    if accessions is not None:
+        return list(accessions)
+    if accession:
+        return focus_level if isinstance(focus_level, list) else [str(focus_level)]
+
+    genomes = get_subtree_genomes(focus_level, reference_only=not all, partial=partial)
+
+    return [a for a, _ in genomes]
+
+
+def get_content_sizes(focus_level, file_names, all=False, accession=False):
+    """
+    Size in MB of the stored files of each content type, {content: file name}.
+    Taxa above the exported clades only count the files of the clades.
+    """
+    con = get_connection()
+    if not accession and not in_clades(con, str(focus_level)):
+        print(
+            f"[WARNING] Only the files of the exported clades are in snapshot "
+            f"{SNAPSHOT_PATH}, size of {focus_level} is partial"
+        )
+    accessions = get_package_accessions(
+        focus_level, all=all, accession=accession, partial=True
+    )
+
+    sizes = {}
+    for content, file_name in file_names.items():
+        size = 0
+        for a in accessions:
+            row = con.execute(
+                "SELECT size FROM files WHERE accession = ? AND name = ?", (a, file_name)
+            ).fetchone()
+            size += row[0] if row is not None else 0
+        sizes[content] = size / 1024**2
+
+    return sizes
+
+
+def write_package(output_path, focus_level, accessions, file_names):
+    """
+    Writes the zip that `datasets download` would give for the accessions
+    (or the reference assemblies of focus_level), from the stored files.
+    """
+    con = get_connection()
+    accessions = get_package_accessions(focus_level, accessions)
+
+    records, checksums = [], []
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zip_f:
+        for a in accessions:
+            row = con.execute(
+                "SELECT record FROM packages WHERE accession = ?", (a,)
+            ).fetchone()
+            if row is None:
+                print(f"[ERROR] Files of {a} not in snapshot {SNAPSHOT_PATH}")
+                sys.exit(1)
+            records.append(row[0])
+
+            for file_name in file_names:
+                file_row = con.execute(
+                    "SELECT md5, data FROM files WHERE accession = ? AND name = ?",
+                    (a, file_name),
+                ).fetchone()
+                if file_row is None:
+                    print(f"[WARNING] No {file_name} for {a} in snapshot")
+                    continue
+                path = f"ncbi_dataset/data/{a}/{file_name}"
+                zip_f.writestr(path, zlib.decompress(file_row[1]))
+                checksums.append(f"{file_row[0]}  {path}")
+
+        zip_f.writestr(
+            "ncbi_dataset/data/assembly_data_report.jsonl",
+            "".join(f"{r}\n" for r in records),
+        )
+        zip_f.writestr("md5sum.txt", "".join(f"{c}\n" for c in checksums))
+
+    print(f"[INFO] Package of {len(accessions)} assemblies written from snapshot")
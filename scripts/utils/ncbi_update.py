@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sys
+
+import pandas as pd
+import utils.integrity as integrity
+import utils.ministats as ministats
+import utils.ncbi_requests as ncbi_requests
+import utils.pipeline_state as pipeline_state
+
+
+def get_accession_base(accession):
+    """
+    Accession without version, GCF_000001405.40 -> GCF_000001405
+    """
+    return str(accession).rsplit(".", 1)[0]
+
+
+def plan_update(report, candidates):
+    """
+    Compares the annotations of an existing annotations_report.tsv with the
+    ones currently available at NCBI. Returns the accessions to download
+    (new, new version or newer annotation release) and the ones to retire
+    (replaced or no longer available).
+    """
+    existing = dict(
+        zip(
+            report["Assembly_Accession"],
+            pd.to_datetime(report["Annotation_Release_Date"], errors="coerce"),
+        )
+    )
+    current = dict(
+        zip(
+            candidates["Assembly_Accession"],
+            pd.to_datetime(candidates["Annotation_Release_Date"], errors="coerce"),
+        )
+    )
+
+    to_download = []
+    for accession, release_date in current.items():
+        if accession not in existing:
+            to_download.append(accession)
+        elif pd.notna(release_date) and (
+            pd.isna(existing[accession]) or release_date > existing[accession]
+        ):
+            to_download.append(accession)  # same assembly, new annotation release
+
+    to_retire = [a for a in existing if a not in current or a in to_download]
+
+    current_bases = {get_accession_base(a) for a in current}
+    superseded = [a for a in to_retire if get_accession_base(a) in current_bases]
+    print(
+        f"[INFO] Update: {len(to_download)} to download, {len(to_retire)} to retire "
+        f"({len(superseded)} replaced by a newer version or release)"
+    )
+
+    return to_download, to_retire
+
+
+def retire_annotations(base_folder, accessions):
+    """
+    Moves the files of retired annotations to annotations_retired.
+    """
+    annotations_dir = os.path.join(base_folder, "annotations_ncbi")
+    retired_dir = os.path.join(base_folder, "annotations_retired")
+    os.makedirs(retired_dir, exist_ok=True)
+
+    retired = set(accessions)
+    for a in os.listdir(annotations_dir):
+        if ncbi_requests.get_flattened_accession(a) in retired:
+            shutil.move(os.path.join(annotations_dir, a), os.path.join(retired_dir, a))
+
+    print(f"[INFO] {len(retired)} annotation(s) moved to: {retired_dir}")
+
+
+def refresh_manifest(base_folder, manifest_path, manifest):
+    """
+    Records the updated annotations as the flattened stage of the run
+    manifest, with their verified checksums.
+    """
+    checksums = {}
+    verified_md5_path = os.path.join(base_folder, integrity.VERIFIED_MD5)
+    if os.path.isfile(verified_md5_path):
+        checksums = {
+            os.path.join(base_folder, p): c
+            for p, c in integrity.read_md5_file(verified_md5_path).items()
+        }
+    pipeline_state.complete_stage(
+        manifest_path,
+        manifest,
+        "flattened",
+        pipeline_state.list_files(os.path.join(base_folder, "annotations_ncbi")),
+        checksums=checksums,
+    )
+
+
+def update_annotations(
+    base_folder,
+    input_taxid,
+    focus_taxid,
+    candidates,
+    threads=8,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+    manifest_path=None,
+    manifest=None,
+):
+    """
+    Brings an existing run up to date with the candidates currently
+    available: only new or superseded annotations are downloaded, replaced
+    ones are retired and annotations_report.tsv (and ministats, when present)
+    are updated in place. When the run manifest is given its flattened stage
+    is refreshed, the caller records the later stages it rewrites.
+    Returns the updated report.
+    """
+    report_path = os.path.join(base_folder, "annotations_report.tsv")
+    if not os.path.isfile(report_path):
+        print(f"[ERROR] No previous run found: {report_path} is missing")
+        print("[ERROR] Run get_annotations.py without --update first")
+        sys.exit(1)
+
+    report = pd.read_csv(report_path, sep="\t")
+    to_download, to_retire = plan_update(report, candidates)
+
+    if not to_download and not to_retire:
+        print("[INFO] Annotations are already up to date")
+        if manifest is not None:
+            refresh_manifest(base_folder, manifest_path, manifest)
+        return report
+
+    # download first, nothing is retired if the download fails
+    verified = {}
+    if to_download:
+        zip_path = ncbi_requests.download_annotation(
+            focus_taxid,
+            annotations_dir=os.path.dirname(base_folder),
+            zip_name=f"{os.path.basename(base_folder)}_update.zip",
+            accessions=to_download,
+            include=include,
+        )
+        update_location = ncbi_requests.extract_annotation_zip(zip_path, threads=threads)
+        verified = integrity.verify_and_repair(
+            update_location, focus_taxid, threads, include=include
+        )
+        ncbi_requests.flatten_and_rename_gff(update_location, include)
+        new_report = ncbi_requests.build_annotation_report(
+            update_location, input_taxid, focus_taxid
+        )
+
+    if to_retire:
+        retire_annotations(base_folder, to_retire)
+        report = report[~report["Assembly_Accession"].isin(to_retire)]
+
+    if to_download:
+        new_annotations_dir = os.path.join(update_location, "annotations_ncbi")
+        annotations_dir = os.path.join(base_folder, "annotations_ncbi")
+        for a in os.listdir(new_annotations_dir):
+            shutil.move(
+                os.path.join(new_annotations_dir, a), os.path.join(annotations_dir, a)
+            )
+        shutil.rmtree(update_location)
+
+        report = report.astype({"Organism_Taxonomic_ID": str})
+        report = pd.concat([report, new_report], ignore_index=True)
+
+    # keep the verified hashes of the run in sync
+    verified_md5_path = os.path.join(base_folder, integrity.VERIFIED_MD5)
+    checksums = {}
+    if os.path.isfile(verified_md5_path):
+        checksums = integrity.read_md5_file(verified_md5_path)
+    retired = set(to_retire)
+    checksums = {
+        p: c
+        for p, c in checksums.items()
+        if ncbi_requests.get_flattened_accession(os.path.basename(p)) not in retired
+    }
+    checksums.update(integrity.get_flattened_checksums(verified, include))
+    integrity.write_md5_file(verified_md5_path, checksums)
+
+    report.to_csv(report_path, index=False, sep="\t")
+    print(f"[INFO] Annotation report updated: {report_path}")
+
+    ministats_dir = os.path.join(base_folder, "ministats")
+    if os.path.isdir(ministats_dir):
+        genome_sizes = ministats.get_assembly_metadata(report_path)
+        ministats.update_ministats(
+            os.path.join(base_folder, "annotations_ncbi"), genome_sizes, ministats_dir
+        )
+
+    if manifest is not None:
+        refresh_manifest(base_folder, manifest_path, manifest)
+
+    return report
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import utils.integrity as integrity
+import utils.ministats as ministats
+import utils.ncbi_requests as ncbi_requests
+import utils.pipeline_state as pipeline_state
+
+REPORT_JSONL = os.path.join("ncbi_dataset", "data", "assembly_data_report.jsonl")
+
+
+def get_genome_sizes(report_jsonl):
+    """
+    Total sequence length of each assembly of an assembly_data_report.jsonl.
+    """
+    genome_sizes = {}
+    with open(report_jsonl) as in_f:
+        for line in in_f:
+            record = json.loads(line)
+            size = record.get("assemblyStats", {}).get("totalSequenceLength")
+            if size is not None:
+                genome_sizes[record["accession"]] = int(size)
+
+    return genome_sizes
+
+
+def process_batch(zip_path, download_location, focus_taxid, include, index):
+    """
+    Extracts, verifies and flattens one downloaded batch, moves its files
+    into the run and computes the ministats of its gffs. Returns the verified
+    checksums of the flattened files, the stats and their fingerprints.
+    """
+    batch_location = ncbi_requests.extract_annotation_zip(zip_path, threads=1)
+    verified = integrity.verify_and_repair(
+        batch_location, focus_taxid, threads=1, include=include
+    )
+    ncbi_requests.flatten_and_rename_gff(batch_location, include)
+
+    annotations_dir = os.path.join(download_location, "annotations_ncbi")
+    batch_annotations_dir = os.path.join(batch_location, "annotations_ncbi")
+    for a in os.listdir(batch_annotations_dir):
+        shutil.move(
+            os.path.join(batch_annotations_dir, a), os.path.join(annotations_dir, a)
+        )
+
+    # the assemblies metadata of all the batches make the run report, kept
+    # per batch until the end (removed with ncbi_dataset at cleanup)
+    batch_report = get_batch_report(download_location, index)
+    shutil.move(os.path.join(batch_location, REPORT_JSONL), batch_report)
+    genome_sizes = get_genome_sizes(batch_report)
+
+    ministats_dir = os.path.join(download_location, "ministats")
+    tables, fingerprints = [], {}
+    for accession, genome_size in genome_sizes.items():
+        gff_path = os.path.join(annotations_dir, f"{accession}.gff")
+        if not os.path.isfile(gff_path):
+            continue
+        target = os.path.join(ministats_dir, f"ministats_{accession}.tsv")
+        if ministats.run_ministats(gff_path, genome_size, target) != 0:
+            continue  # not recorded, computed by get_ministats.py later
+        tables.append(ministats.read_ministats(target, accession))
+        fingerprints[accession] = pipeline_state.get_fingerprint(gff_path, genome_size)
+
+    shutil.rmtree(batch_location)
+
+    return integrity.get_flattened_checksums(verified, include), tables, fingerprints
+
+
+def get_batch_report(download_location, index):
+
+    return os.path.join(
+        download_location, "ncbi_dataset", "data", f"assembly_data_report_{index}.jsonl"
+    )
+
+
+def record_batch(download_location, batch, verified, fingerprints):
+    """
+    Manifest entry of a processed batch: its accessions, the checksums and
+    fingerprints of its flattened files and the fingerprints of its ministats.
+    """
+    return {
+        "accessions": batch,
+        "checksums": verified,
+        "outputs": {
+            p: pipeline_state.get_fingerprint(os.path.join(download_location, p))
+            for p in verified
+        },
+        "ministats": fingerprints,
+    }
+
+
+def load_batch(download_location, record, batch, index):
+    """
+    Results of a batch processed by an interrupted run, None if its
+    accessions or outputs changed since.
+    """
+    if record is None or record["accessions"] != batch:
+        return None
+    if not os.path.isfile(get_batch_report(download_location, index)):
+        return None
+    for path, fingerprint in record["outputs"].items():
+        full_path = os.path.join(download_location, path)
+        if not os.path.isfile(full_path):
+            return None
+        if pipeline_state.get_fingerprint(full_path) != fingerprint:
+            return None
+
+    ministats_dir = os.path.join(download_location, "ministats")
+    tables, fingerprints = [], {}
+    for accession, fingerprint in record["ministats"].items():
+        target = os.path.join(ministats_dir, f"ministats_{accession}.tsv")
+        if os.path.isfile(target):  # otherwise computed by get_ministats.py later
+            tables.append(ministats.read_ministats(target, accession))
+            fingerprints[accession] = fingerprint
+
+    return record["checksums"], tables, fingerprints
+
+
+def run_pipeline(
+    download_location,
+    focus_taxid,
+    accessions,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+    batch_size=10,
+    downloads=2,
+    workers=4,
+    manifest_path=None,
+    manifest=None,
+):
+    """
+    Downloads the accessions in batches and, as soon as a batch arrives,
+    extracts, verifies, flattens it and computes its ministats on a pool of
+    workers while the next batches download. At most 2 * workers batches are
+    downloaded and waiting, so disk and memory stay bounded. Leaves the run
+    as the sequential stages do, with ministats already computed.
+    When a manifest is given, processed batches are recorded in it and the
+    ones recorded by an interrupted run are not downloaded again.
+    Returns the verified checksums of the flattened files.
+    """
+    batches_dir = f"{download_location}_batches"
+    recorded = manifest.setdefault("batches", {}) if manifest is not None else {}
+    if not recorded and os.path.exists(download_location):
+        shutil.rmtree(download_location)
+    if os.path.exists(batches_dir):
+        shutil.rmtree(batches_dir)
+    os.makedirs(os.path.join(download_location, "annotations_ncbi"), exist_ok=True)
+    os.makedirs(os.path.join(download_location, "ministats"), exist_ok=True)
+    os.makedirs(
+        os.path.dirname(os.path.join(download_location, REPORT_JSONL)), exist_ok=True
+    )
+    os.makedirs(batches_dir)
+
+    batches = [
+        accessions[i : i + batch_size] for i in range(0, len(accessions), batch_size)
+    ]
+    done = {}
+    for i, batch in enumerate(batches):
+        result = load_batch(download_location, recorded.get(str(i)), batch, i)
+        if result is not None:
+            done[i] = result
+    print(
+        f"[INFO] Pipelined download of {len(accessions)} assemblies in "
+        f"{len(batches)} batches, {downloads} downloads and {workers} workers"
+    )
+    if done:
+        print(f"[INFO] {len(done)} batches already processed by a previous run")
+
+    pending = threading.BoundedSemaphore(2 * workers)
+    failed = threading.Event()
+    lock = threading.Lock()
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as worker_pool:
+
+        def work(i, batch, zip_path):
+            try:
+                result = process_batch(
+                    zip_path, download_location, focus_taxid, include, i
+                )
+                if manifest is not None:
+                    with lock:
+                        recorded[str(i)] = record_batch(
+                            download_location, batch, result[0], result[2]
+                        )
+                        pipeline_state.save_manifest(manifest_path, manifest)
+                return result
+            except BaseException:
+                failed.set()
+                raise
+            finally:
+                pending.release()
+
+        def download_batch(i, batch):
+            try:
+                zip_path = ncbi_requests.download_annotation(
+                    focus_taxid,
+                    annotations_dir=batches_dir,
+                    zip_name=f"batch_{i}.zip",
+                    accessions=batch,
+                    include=include,
+                )
+            except BaseException:
+                pending.release()
+                failed.set()
+                raise
+
+            # extraction runs on the workers, the download slot is free again
+            results[i] = worker_pool.submit(work, i, batch, zip_path)
+
+        with ThreadPoolExecutor(max_workers=downloads) as download_pool:
+            download_futures = []
+            for i, batch in enumerate(batches):
+                if i in done:
+                    continue
+                pending.acquire()  # waits while too many batches are on disk
+                if failed.is_set():
+                    pending.release()
+                    break
+                download_futures.append(download_pool.submit(download_batch, i, batch))
+
+        # errors (including sys.exit of a failed command) are raised here
+        for future in download_futures:
+            future.result()
+    for future in results.values():
+        future.result()
+
+    shutil.rmtree(batches_dir)
+
+    for i, future in results.items():
+        done[i] = future.result()
+
+    verified, tables, fingerprints = {}, [], {}
+    with open(os.path.join(download_location, REPORT_JSONL), "w") as out_f:
+        for i in sorted(done):
+            batch_verified, batch_tables, batch_fingerprints = done[i]
+            verified.update(batch_verified)
+            tables += batch_tables
+            fingerprints.update(batch_fingerprints)
+
+            batch_report = get_batch_report(download_location, i)
+            with open(batch_report) as in_f:
+                shutil.copyfileobj(in_f, out_f)
+
+    if tables:
+        stats = pd.concat(tables, ignore_index=True).astype(ministats.STATS_DTYPES)
+        ministats.save_ministats(
+            stats, fingerprints, os.path.join(download_location, "ministats")
+        )
+        print(f"[INFO] Ministats of {len(fingerprints)} annotations computed")
+
+    return verified
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from datetime import datetime
+
+# Stages of get_annotations.py, in the order they run
+STAGES = ["downloaded", "extracted", "flattened", "report", "plots", "cleanup"]
+
+
+def list_files(directory):
+    """
+    All the files below directory, walking subfolders.
+    """
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def get_fingerprint(path, *extra):
+    """
+    Cheap identity of a file, its size and modification time (kept when the
+    file is moved), followed by any extra values it was processed with.
+    """
+    stat = os.stat(path)
+
+    return ":".join(str(v) for v in (stat.st_size, stat.st_mtime_ns) + extra)
+
+
+def load_manifest(manifest_path):
+
+    if not os.path.isfile(manifest_path):
+        return {"stages": {}}
+
+    with open(manifest_path) as in_f:
+        return json.load(in_f)
+
+
+def save_manifest(manifest_path, manifest):
+
+    # write then rename, a kill never leaves a half written manifest
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as out_f:
+        json.dump(manifest, out_f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def check_arguments(manifest_path, manifest, arguments):
+    """
+    Records the arguments deciding what is downloaded (selection filters,
+    included content...) in a new manifest, or exits if a previous run was
+    made with different ones: its downloads can not be reused.
+    """
+    arguments = json.loads(json.dumps(arguments))  # as stored in the manifest
+
+    if not manifest["stages"] and "running" not in manifest:
+        manifest["arguments"] = arguments
+        save_manifest(manifest_path, manifest)
+        return
+
+    previous = manifest.get("arguments", {})
+    changed = sorted(
+        name
+        for name in set(previous) | set(arguments)
+        if previous.get(name) != arguments.get(name)
+    )
+    if changed:
+        print(f"[ERROR] Previous run in {manifest_path} used different arguments:")
+        for name in changed:
+            print(f"[ERROR]   {name}: {previous.get(name)} now {arguments.get(name)}")
+        print("[ERROR] Rerun with the same arguments or remove the manifest to start over")
+        sys.exit(1)
+
+
+def start_stage(manifest_path, manifest, stage):
+    """
+    Records stage as running: if the run is killed, the rerun starts again
+    from this stage instead of verifying the outputs it was consuming.
+    """
+    manifest["running"] = stage
+    save_manifest(manifest_path, manifest)
+
+
+def complete_stage(manifest_path, manifest, stage, outputs, checksums=None):
+    """
+    Records stage as completed with the list of its output files and their
+    fingerprints. Checksums already known (e.g. verified downloads) are kept
+    too, nothing is hashed here.
+    """
+    outputs = list(outputs)
+    checksums = checksums or {}
+
+    manifest["stages"][stage] = {
+        "completed": datetime.now().isoformat(timespec="seconds"),
+        "outputs": {path: get_fingerprint(path) for path in outputs},
+        "checksums": {path: checksums[path] for path in outputs if path in checksums},
+    }
+    manifest.pop("running", None)
+    save_manifest(manifest_path, manifest)
+    print(f"[INFO] Stage {stage} completed")
+
+
+def verify_stage(manifest, stage):
+    """
+    True if stage was completed and all its outputs are still there, unchanged.
+    """
+    record = manifest["stages"].get(stage)
+    if record is None:
+        return False
+
+    for path, fingerprint in record["outputs"].items():
+        if not os.path.isfile(path) or get_fingerprint(path) != fingerprint:
+            print(f"[WARNING] Output of stage {stage} missing or changed: {path}")
+            return False
+
+    return True
+
+
+def get_resume_stage(manifest):
+    """
+    Returns the first stage to run. A stage interrupted while running is run
+    again, stages pick up their partial work. Otherwise it is the stage after
+    the last completed one whose outputs verify: outputs of a stage are
+    consumed by the next ones, so the latest stages are checked first.
+    None means all done, the first stage means starting from scratch.
+    """
+    if manifest.get("running") is not None:
+        return manifest["running"]
+
+    completed = [s for s in STAGES if s in manifest["stages"]]
+    for stage in reversed(completed):
+        if verify_stage(manifest, stage):
+            next_index = STAGES.index(stage) + 1
+            return STAGES[next_index] if next_index < len(STAGES) else None
+
+    return STAGES[0]
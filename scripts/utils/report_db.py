@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import pandas as pd
+import utils.ministats as ministats
+
+DB_FILE = "annotations.sqlite"
+
+# One row per assembly, report columns not known yet are added on ingestion
+ASSEMBLY_COLUMNS = {
+    "Assembly_Accession": "TEXT PRIMARY KEY",
+    "Organism_Taxonomic_ID": "INTEGER",
+    "lca_rank": "TEXT",
+    "Annotation_Provider": "TEXT",
+    "Annotation_Release_Date": "TEXT",
+    "Report_Path": "TEXT",
+    "Ingested": "TEXT",
+}
+INDEXED_COLUMNS = [
+    "Organism_Taxonomic_ID",
+    "lca_rank",
+    "Annotation_Provider",
+    "Annotation_Release_Date",
+]
+
+# One row per assembly and feature, as in ministats.parquet
+MINISTATS_COLUMNS = {
+    "Assembly_Accession": "TEXT",
+    "Feature": "TEXT",
+    "Features_Count": "INTEGER",
+    "Total_Feature_Length": "INTEGER",
+    "Average_Feature_Length": "REAL",
+    "Genome_Percentage": "REAL",
+}
+
+
+def quote(name):
+
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(db_path):
+    """
+    Opens (creating it if needed) the database with its tables and indexes.
+    """
+    con = sqlite3.connect(db_path)
+
+    columns = ", ".join(f"{quote(c)} {t}" for c, t in ASSEMBLY_COLUMNS.items())
+    con.execute(f"CREATE TABLE IF NOT EXISTS assemblies ({columns})")
+    for column in INDEXED_COLUMNS:
+        con.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote('idx_' + column)} "
+            f"ON assemblies ({quote(column)})"
+        )
+
+    columns = ", ".join(f"{quote(c)} {t}" for c, t in MINISTATS_COLUMNS.items())
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS ministats ({columns}, "
+        "PRIMARY KEY (Assembly_Accession, Feature))"
+    )
+
+    return con
+
+
+def get_sql_type(dtype):
+
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+
+    return "TEXT"
+
+
+def add_missing_columns(con, table, df):
+
+    known = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+    for column in df.columns:
+        if column not in known:
+            con.execute(
+                f"ALTER TABLE {table} ADD COLUMN {quote(column)} "
+                f"{get_sql_type(df[column].dtype)}"
+            )
+
+
+def get_records(df):
+    """
+    Rows of df as tuples of python values, missing values as None.
+    """
+    df = df.astype(object).where(df.notna(), None)
+
+    return [
+        tuple(v.item() if hasattr(v, "item") else v for v in row)
+        for row in df.itertuples(index=False, name=None)
+    ]
+
+
+def upsert_report(con, report, report_path):
+    """
+    Inserts the assemblies of an annotation report, replacing the rows of
+    those already in the database: columns missing from the new report are
+    left empty, not kept from the previous one.
+    """
+    report = report.rename(columns={c: c.replace(" ", "_") for c in report.columns})
+    report = report.drop_duplicates(subset="Assembly_Accession", keep="first")
+    report = report.assign(
+        Report_Path=os.path.abspath(report_path),
+        Ingested=datetime.now().isoformat(timespec="seconds"),
+    )
+
+    columns = [quote(c) for c in report.columns]
+
+    with con:
+        add_missing_columns(con, "assemblies", report)
+        con.executemany(
+            f"INSERT OR REPLACE INTO assemblies ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})",
+            get_records(report),
+        )
+
+    return len(report)
+
+
+def upsert_ministats(con, stats):
+    """
+    Replaces the ministats of the assemblies in stats.
+    """
+    stats = stats[list(MINISTATS_COLUMNS)]
+    accessions = [(a,) for a in stats["Assembly_Accession"].unique()]
+
+    with con:
+        con.executemany("DELETE FROM ministats WHERE Assembly_Accession = ?", accessions)
+        con.executemany(
+            f"INSERT INTO ministats VALUES ({', '.join('?' * len(MINISTATS_COLUMNS))})",
+            get_records(stats),
+        )
+
+    return len(accessions)
+
+
+def ingest(con, path):
+    """
+    Ingests an annotations_report.tsv, or a run folder containing one and,
+    when present, its ministats.
+    """
+    if os.path.isdir(path):
+        report_path = os.path.join(path, "annotations_report.tsv")
+        ministats_dir = os.path.join(path, "ministats")
+    else:
+        report_path = path
+        ministats_dir = os.path.join(os.path.dirname(path), "ministats")
+
+    if not os.path.isfile(report_path):
+        print(f"[ERROR] Annotation report not found: {report_path}")
+        sys.exit(1)
+
+    count = upsert_report(con, pd.read_csv(report_path, sep="\t"), report_path)
+    print(f"[INFO] {count} assemblies ingested from {report_path}")
+
+    if os.path.isfile(os.path.join(ministats_dir, ministats.STATS_FILE)):
+        stats, _ = ministats.load_ministats(ministats_dir)
+        count = upsert_ministats(con, stats)
+        print(f"[INFO] Ministats of {count} assemblies ingested from {ministats_dir}")
+
+
+def query(con, sql, params=()):
+
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        print(f"[ERROR] Query failed: {e}")
+        sys.exit(1)
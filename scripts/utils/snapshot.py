@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from datetime import datetime
+
+import utils.integrity as integrity
+import utils.ncbi_requests as ncbi_requests
+import utils.ncbi_snapshot as ncbi_snapshot
+import utils.pipeline as pipeline
+
+
+def get_clade_genomes(clade):
+    """
+    Genome summaries of the annotated assemblies of clade, by accession.
+    """
+    genomes = {}
+    for report in ncbi_requests.iter_genome_summary(clade):
+        genomes[report["accession"]] = report
+    print(f"[INFO] {len(genomes)} annotated assemblies found for {clade}")
+
+    return genomes
+
+
+def count_genomes(genomes, lineages, tax_ids):
+    """
+    Reference and total annotation counts of each of tax_ids, joining the
+    genomes to their lineages locally.
+    """
+    counts = {t: [0, 0] for t in tax_ids}
+    for report in genomes.values():
+        tax_id = str(report["organism"]["tax_id"])
+        for target in lineages.get(tax_id, set()).intersection(counts):
+            counts[target][1] += 1
+            if ncbi_requests.is_reference_genome(report):
+                counts[target][0] += 1
+
+    return counts
+
+
+def add_files(con, clade, accessions, include, threads=8):
+    """
+    Downloads and verifies the files of the accessions of clade, then
+    stores them compressed with their md5 and assembly_data_report record.
+    """
+    file_names = {ncbi_requests.CONTENT_TYPES[c]["file"] for c in include}
+
+    with tempfile.TemporaryDirectory(prefix="phylocontext_snapshot_") as tmp_dir:
+        zip_path = ncbi_requests.download_annotation(
+            clade,
+            annotations_dir=tmp_dir,
+            zip_name=f"{clade}.zip",
+            accessions=accessions,
+            include=include,
+        )
+        location = ncbi_requests.extract_annotation_zip(zip_path, threads=threads)
+        verified = integrity.verify_and_repair(location, clade, threads, include=include)
+
+        with open(os.path.join(location, pipeline.REPORT_JSONL)) as in_f:
+            records = [line.strip() for line in in_f if line.strip()]
+        con.executemany(
+            "INSERT OR REPLACE INTO packages VALUES (?, ?)",
+            [(json.loads(r)["accession"], r) for r in records],
+        )
+
+        # every extracted file of the included content, the ones the package
+        # does not list (e.g. rehydrated ones) are hashed here
+        paths = [
+            p
+            for p in integrity.get_unlisted_files(location, {})
+            if os.path.basename(p) in file_names
+        ]
+        unlisted = [p for p in paths if p not in verified]
+        checksums = integrity.hash_files(
+            [os.path.join(location, p) for p in unlisted], threads
+        )
+        for path in paths:
+            accession, name = integrity.get_accession(path), os.path.basename(path)
+            md5 = verified.get(path) or checksums[os.path.join(location, path)]
+            with open(os.path.join(location, path), "rb") as in_f:
+                data = in_f.read()
+            con.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (accession, name, md5, len(data), zlib.compress(data)),
+            )
+        con.commit()
+
+        shutil.rmtree(location)
+
+    print(f"[INFO] Files of {len(records)} assemblies of {clade} stored")
+
+
+def export_snapshot(
+    snapshot_path,
+    clades,
+    files=None,
+    include=ncbi_requests.DEFAULT_INCLUDE,
+    threads=8,
+):
+    """
+    Collects, with the current backend, the taxonomy summaries of the clades,
+    their descendants and ancestors, the genome summaries and annotation
+    counts and, if files is "reference" or "all", the files of those
+    assemblies, into one snapshot file. The file is written next to
+    snapshot_path and moved in place once complete.
+    """
+    clades = list(dict.fromkeys(str(c) for c in clades))
+
+    taxonomy = {}
+    for clade in clades:
+        taxonomy.update(ncbi_requests.get_dataset_json(clade, children=True))
+    in_clades = set(taxonomy)
+    ancestors = {
+        str(p) for t in in_clades for p in taxonomy[t]["taxonomy"].get("parents", [])
+    }
+    taxonomy.update(ncbi_requests.get_dataset_json_batch(ancestors - in_clades))
+    print(
+        f"[INFO] {len(in_clades)} taxa in {len(clades)} clade(s) and "
+        f"{len(ancestors - in_clades)} ancestors"
+    )
+
+    clade_genomes = {clade: get_clade_genomes(clade) for clade in clades}
+    genomes = {a: r for g in clade_genomes.values() for a, r in g.items()}
+    genome_taxa = {str(r["organism"]["tax_id"]) for r in genomes.values()}
+    # e.g. strains not listed as children
+    missing = genome_taxa - set(taxonomy)
+    if missing:
+        taxonomy.update(ncbi_requests.get_dataset_json_batch(missing))
+        in_clades.update(missing.intersection(taxonomy))
+    lineages = ncbi_requests.get_lineages(genome_taxa, taxonomy)
+
+    # descendants of the clades are counted locally, their ancestors are queried
+    counts = count_genomes(genomes, lineages, in_clades)
+    ancestor_counts = ncbi_requests.get_annotation_counts(
+        ancestors - in_clades, threads=threads
+    )
+    for tax_id, c in ancestor_counts.items():
+        counts[tax_id] = [c["annotation_count_ref"], c["annotation_count_all"]]
+
+    tmp_path = f"{snapshot_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = ncbi_snapshot.create_snapshot(tmp_path)
+
+    meta = {
+        "version": ncbi_snapshot.SNAPSHOT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "clades": ",".join(clades),
+        "backend": ncbi_requests.BACKEND,
+        "files": files or "",
+        "include": ",".join(include) if files else "",
+    }
+    con.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+    con.executemany("INSERT INTO clades VALUES (?)", [(c,) for c in clades])
+    con.executemany(
+        "INSERT INTO taxonomy VALUES (?, ?)",
+        [(t, json.dumps(report)) for t, report in taxonomy.items()],
+    )
+    con.executemany(
+        "INSERT INTO lineage VALUES (?, ?)",
+        [
+            (t, str(p))
+            for t, report in taxonomy.items()
+            for p in report["taxonomy"].get("parents", [])
+        ],
+    )
+    con.executemany(
+        "INSERT INTO counts VALUES (?, ?, ?)",
+        [(t, ref, all) for t, (ref, all) in counts.items()],
+    )
+    con.executemany(
+        "INSERT INTO genomes VALUES (?, ?, ?, ?)",
+        [
+            (
+                a,
+                str(r["organism"]["tax_id"]),
+                int(ncbi_requests.is_reference_genome(r)),
+                json.dumps(r),
+            )
+            for a, r in genomes.items()
+        ],
+    )
+    con.commit()
+
+    if files is not None:
+        for clade, clade_reports in clade_genomes.items():
+            accessions = [
+                a
+                for a, r in clade_reports.items()
+                if files == "all" or ncbi_requests.is_reference_genome(r)
+            ]
+            if accessions:
+                add_files(con, clade, accessions, include, threads)
+
+    con.execute("VACUUM")
+    con.close()
+    os.replace(tmp_path, snapshot_path)
+
+    print(
+        f"[INFO] Snapshot of {len(taxonomy)} taxa and {len(genomes)} assemblies "
+        f"saved at {snapshot_path}"
+    )
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import utils.ncbi_requests as ncbi_requests
+
+
+def encode_lineages(lineages):
+    """
+    Takes lineages as lists of taxids (root first, taxon last) and returns
+    them as rows of an integer matrix, padded with -1.
+    """
+    depth = max(len(lineage) for lineage in lineages)
+    encoded = np.full((len(lineages), depth), -1, dtype=np.int64)
+    for i, lineage in enumerate(lineages):
+        encoded[i, : len(lineage)] = lineage
+
+    return encoded
+
+
+def compute_lca_depth(encoded):
+    """
+    Number of shared lineage levels of every pair of rows, the depth of
+    their last common ancestor. One vectorized N x N pass per level.
+    """
+    n, depth = encoded.shape
+    shared = np.ones((n, n), dtype=bool)
+    lca_depth = np.zeros((n, n), dtype=np.uint16)
+
+    for level in range(depth):
+        column = encoded[:, level]
+        shared &= (column[:, None] == column[None, :]) & (column >= 0)[:, None]
+        if not shared.any():
+            break
+        lca_depth += shared
+
+    return lca_depth
+
+
+def compute_distance_matrix(tax_ids, dataset_dict=None):
+    """
+    Pairwise taxonomic relation of the given taxa (one per assembly,
+    duplicates allowed). Returns a dictionary of N x N matrices: lca_depth,
+    distance (levels from one taxon to the other through the LCA),
+    lca_taxid and lca_rank (index in rank_names).
+    """
+    tax_ids = [str(t) for t in tax_ids]
+    dataset_dict = dict(dataset_dict or {})
+
+    missing = [t for t in set(tax_ids) if t not in dataset_dict]
+    dataset_dict.update(ncbi_requests.get_dataset_json_batch(missing) if missing else {})
+
+    lineages = [
+        [int(p) for p in dataset_dict[t]["taxonomy"].get("parents", [])] + [int(t)]
+        for t in tax_ids
+    ]
+    encoded = encode_lineages(lineages)
+    lengths = np.array([len(lineage) for lineage in lineages], dtype=np.int32)
+
+    lca_depth = compute_lca_depth(encoded)
+    distance = (lengths[:, None] + lengths[None, :] - 2 * lca_depth).astype(np.uint16)
+
+    lca_index = np.clip(lca_depth.astype(np.int64) - 1, 0, None)
+    lca_taxid = np.take_along_axis(encoded, lca_index, axis=1)
+    lca_taxid[lca_depth == 0] = -1
+
+    # ranks of the ancestors, fetched in batch when not known yet
+    lca_taxa = [str(t) for t in np.unique(lca_taxid) if t >= 0]
+    missing = [t for t in lca_taxa if t not in dataset_dict]
+    dataset_dict.update(ncbi_requests.get_dataset_json_batch(missing) if missing else {})
+    taxon_ranks = {
+        int(t): dataset_dict.get(t, {}).get("taxonomy", {}).get("rank", "NO_RANK")
+        for t in lca_taxa
+    }
+    rank_names = sorted(set(taxon_ranks.values()))
+    rank_codes = {-1: -1}
+    rank_codes.update({t: rank_names.index(r) for t, r in taxon_ranks.items()})
+    unique_taxa, inverse = np.unique(lca_taxid, return_inverse=True)
+    lca_rank = np.array([rank_codes[int(t)] for t in unique_taxa], dtype=np.int8)[
+        inverse.reshape(lca_taxid.shape)
+    ]
+
+    return {
+        "lineages": encoded,
+        "lca_depth": lca_depth,
+        "distance": distance,
+        "lca_taxid": lca_taxid.astype(np.int32),
+        "lca_rank": lca_rank,
+        "rank_names": np.array(rank_names),
+    }
+
+
+def get_taxonomic_order(encoded):
+    """
+    Row order sorting lineages root first, so that related taxa are next to
+    each other as the leaves of the taxonomy tree.
+    """
+    return np.lexsort(encoded.T[::-1])
+
+
+def build_distance_matrix(annotation_report, output_path, dataset_dict=None):
+    """
+    Computes the distances between the assemblies of an annotation report
+    and saves them, with their accessions, as a compressed .npz. Lineages
+    already in dataset_dict (e.g. the focus with its children) are not
+    fetched again.
+    """
+    print("[INFO] Computing pairwise taxonomic distances")
+    matrix = compute_distance_matrix(
+        annotation_report["Organism_Taxonomic_ID"].tolist(), dataset_dict
+    )
+    matrix["accessions"] = annotation_report["Assembly_Accession"].to_numpy(dtype=str)
+
+    np.savez_compressed(output_path, **matrix)
+    print(f"[INFO] Pairwise taxonomic distances saved to: {output_path}")
+
+    return matrix
+
+
+def load_distance_matrix(matrix_path):
+
+    with np.load(matrix_path) as data:
+        return {k: data[k] for k in data.files}